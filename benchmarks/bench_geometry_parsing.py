@@ -0,0 +1,63 @@
+"""Benchmark of geometry parsing on waypoint-heavy diagrams.
+
+Builds a page with many edges with many waypoints, with whole or fractional
+coordinates, and compares converting its coordinates field by field with
+converting them through a NumberTable, which converts every distinct string
+once, as loading does. It also compares loading the page in bulk
+(MxGraphModel.from_xml) with loading it as a stream of cells
+(MxGraphModel.from_stream).
+
+Usage: python benchmarks/bench_geometry_parsing.py [vertices] [waypoints]
+"""
+
+import io
+import random
+import sys
+import time
+import defusedxml.ElementTree as dxml
+from mxgraph.mxgraph import CellStore, MxGraph, MxGraphModel, NumberTable, parse_number
+
+
+def make_page(vertices, waypoints, fractional):
+    rnd = random.Random(1)
+    g = MxGraph()
+    vs = [ g.insert_vertex(x=rnd.randrange(0, 20000, 10), y=rnd.randrange(0, 20000, 10), width=80, height=40) for i in range(vertices) ]
+    for i in range(4 * vertices):
+        e = g.insert_edge(source=rnd.choice(vs), target=rnd.choice(vs))
+        g.add_edge_geometry(e, [ (rnd.randrange(0, 20000, 10) + (0.5 if fractional and k % 2 else 0), rnd.randrange(0, 20000, 10)) for k in range(waypoints) ])
+    return dxml.tostring(g.mxgraph_model.to_xml(g.cells))
+
+
+def best_of(f, repeat=5):
+    times = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def per_field(model):
+    return [ parse_number(e.get(name)) for tag in ('mxGeometry', 'mxPoint') for e in model.iter(tag) for name in ('x', 'y') ]
+
+
+def by_table(model):
+    numbers = NumberTable()
+    return [ numbers[e.get(name)] for tag in ('mxGeometry', 'mxPoint') for e in model.iter(tag) for name in ('x', 'y') ]
+
+
+def main():
+    vertices = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    waypoints = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for fractional in (False, True):
+        xml = make_page(vertices, waypoints, fractional)
+        model = dxml.fromstring(xml)
+        print('%s coordinates, %d edges with %d waypoints, %d bytes' % ('fractional' if fractional else 'whole', 4 * vertices, waypoints, len(xml)))
+        print('  convert per field   %.3f s' % best_of(lambda: per_field(model)))
+        print('  convert by table    %.3f s' % best_of(lambda: by_table(model)))
+        print('  load from_xml       %.3f s' % best_of(lambda: MxGraphModel.from_xml(CellStore(), model)))
+        print('  load from_stream    %.3f s' % best_of(lambda: MxGraphModel.from_stream(CellStore(), io.BytesIO(xml))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Automatic layout of the vertices under a parent cell.
+
+The layout functions assign MxGeometry positions (and sizes, if missing) to the
+vertex cells that are direct children of a parent cell. Edges between those
+vertices are taken from the whole graph, wherever the edge cells live.
+Each function works in a fixed number of linear passes over the vertices and
+edges, so large generated graphs lay out quickly.
+"""
+
+from collections import deque
+from .mxgraph import MxGeometry, KindQuery, ParentQuery
+
+DEFAULT_WIDTH = 120
+DEFAULT_HEIGHT = 60
+
+
+def _layout_vertices(graph, parent):
+    if parent is None:
+        parent = graph.root
+    return graph.query(ParentQuery(parent) & KindQuery('vertex'))
+
+
+def _size(cell, width, height):
+    g = cell.geometry
+    if g is None:
+        return width, height
+    return (g.width if g.width is not None else width,
+            g.height if g.height is not None else height)
+
+
+def _place(cell, x, y, width, height):
+    if cell.geometry is None:
+        cell.geometry = MxGeometry()
+    g = cell.geometry
+    g.x = int(x)
+    g.y = int(y)
+    if g.width is None:
+        g.width = width
+    if g.height is None:
+        g.height = height
+
+
+def _adjacency(graph, index):
+    """Returns successor and predecessor lists (by position in the vertex list)
+    for the edges between the vertices in index (a cell id -> position map).
+    Self loops and duplicate edges are dropped."""
+    n = len(index)
+    succ = [ [] for _ in range(n) ]
+    pred = [ [] for _ in range(n) ]
+    seen = set()
+    for e in graph.query(KindQuery('edge')):
+        s = index.get(e._source_id)
+        t = index.get(e._target_id)
+        if s is None or t is None or s == t or (s, t) in seen:
+            continue
+        seen.add((s, t))
+        succ[s].append(t)
+        pred[t].append(s)
+    return succ, pred
+
+
+def grid_layout(graph, parent=None, columns=None, spacing=20, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """Places the vertices under parent in a grid with columns columns (by
+    default, a roughly square grid). Every grid cell is as large as the largest
+    vertex. Vertices without a size get width and height.
+    Returns the vertices that were placed.
+    """
+    vertices = _layout_vertices(graph, parent)
+    vertices.sort(key=lambda c: c.cell_id)
+    if not vertices:
+        return vertices
+    sizes = [ _size(v, width, height) for v in vertices ]
+    if columns is None:
+        columns = max(1, int(round(len(vertices) ** 0.5)))
+    step_x = max(w for w, h in sizes) + spacing
+    step_y = max(h for w, h in sizes) + spacing
+    for i, (v, (w, h)) in enumerate(zip(vertices, sizes)):
+        row, col = divmod(i, columns)
+        _place(v, col * step_x, row * step_y, w, h)
+    return vertices
+
+
+def _break_cycles(succ):
+    """Returns the set of edges (s,t) that must be reversed to make the graph
+    acyclic, found with an iterative depth-first search."""
+    n = len(succ)
+    state = [0] * n  # 0 = new, 1 = on stack, 2 = done
+    reversed_edges = set()
+    for start in range(n):
+        if state[start]:
+            continue
+        state[start] = 1
+        stack = [ (start, iter(succ[start])) ]
+        while stack:
+            node, it = stack[-1]
+            for t in it:
+                if state[t] == 0:
+                    state[t] = 1
+                    stack.append((t, iter(succ[t])))
+                    break
+                if state[t] == 1:
+                    reversed_edges.add((node, t))
+            else:
+                state[node] = 2
+                stack.pop()
+    return reversed_edges
+
+
+def _longest_path_layers(succ, pred):
+    n = len(succ)
+    layer = [0] * n
+    indegree = [ len(p) for p in pred ]
+    queue = deque(i for i in range(n) if indegree[i] == 0)
+    while queue:
+        s = queue.popleft()
+        for t in succ[s]:
+            if layer[s] + 1 > layer[t]:
+                layer[t] = layer[s] + 1
+            indegree[t] -= 1
+            if indegree[t] == 0:
+                queue.append(t)
+    return layer
+
+
+def _reduce_crossings(layers, succ, pred, iterations):
+    """Reorders the layers in place with the barycenter heuristic, alternating
+    downward and upward sweeps. An edge may span several layers: the vertex
+    at its far end counts with its relative position in its own layer, so
+    long edges need no dummy nodes in the layers in between."""
+    n = sum(len(l) for l in layers)
+    rank = [0.0] * n
+
+    def update_ranks(layer):
+        size = len(layer)
+        for i, v in enumerate(layer):
+            rank[v] = (i + 0.5) / size
+
+    for layer in layers:
+        update_ranks(layer)
+    for it in range(iterations):
+        if it % 2 == 0:
+            order, neighbours = range(1, len(layers)), pred
+        else:
+            order, neighbours = range(len(layers) - 2, -1, -1), succ
+        for li in order:
+            layer = layers[li]
+
+            def barycenter(v):
+                ns = neighbours[v]
+                if not ns:
+                    return rank[v]
+                return sum(rank[u] for u in ns) / len(ns)
+
+            layer.sort(key=barycenter)
+            update_ranks(layer)
+
+
+def layered_layout(graph, parent=None, layer_spacing=80, node_spacing=30, iterations=4, horizontal=False, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """Places the vertices under parent in layers, Sugiyama style: cycles are
+    broken by reversing back edges, vertices are assigned to layers by longest
+    path so that edges point downward, and the order within every layer is
+    improved by iterations barycenter sweeps to reduce edge crossings. Edges
+    that span several layers take part in the sweeps through the relative
+    position of their far end.
+    Layers run top to bottom, or left to right if horizontal is True.
+    Returns the vertices that were placed.
+    """
+    vertices = _layout_vertices(graph, parent)
+    vertices.sort(key=lambda c: c.cell_id)
+    if not vertices:
+        return vertices
+    index = { v.cell_id: i for i, v in enumerate(vertices) }
+    succ, pred = _adjacency(graph, index)
+    reversed_edges = _break_cycles(succ)
+    if reversed_edges:
+        dag_succ = [ [] for _ in vertices ]
+        dag_pred = [ [] for _ in vertices ]
+        for s, ts in enumerate(succ):
+            for t in ts:
+                if (s, t) in reversed_edges:
+                    s2, t2 = t, s
+                else:
+                    s2, t2 = s, t
+                dag_succ[s2].append(t2)
+                dag_pred[t2].append(s2)
+        succ, pred = dag_succ, dag_pred
+    layer_of = _longest_path_layers(succ, pred)
+    layers = [ [] for _ in range(max(layer_of) + 1) ]
+    for v, l in enumerate(layer_of):
+        layers[l].append(v)
+    _reduce_crossings(layers, succ, pred, iterations)
+
+    sizes = [ _size(v, width, height) for v in vertices ]
+    # position along the layer, and the depth of every layer
+    depth = 0
+    widest = 0
+    rows = []
+    for layer in layers:
+        if horizontal:
+            along = [ sizes[v][1] for v in layer ]
+            across = max(sizes[v][0] for v in layer)
+        else:
+            along = [ sizes[v][0] for v in layer ]
+            across = max(sizes[v][1] for v in layer)
+        total = sum(along) + node_spacing * (len(layer) - 1)
+        widest = max(widest, total)
+        rows.append((layer, along, total, depth))
+        depth += across + layer_spacing
+    for layer, along, total, depth in rows:
+        pos = (widest - total) / 2
+        for v, a in zip(layer, along):
+            w, h = sizes[v]
+            if horizontal:
+                _place(vertices[v], depth, pos, w, h)
+            else:
+                _place(vertices[v], pos, depth, w, h)
+            pos += a + node_spacing
+    return vertices
+
+
+def tree_layout(graph, parent=None, roots=None, level_spacing=60, node_spacing=20, horizontal=False, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """Places the vertices under parent as a tree (or forest) that follows the
+    edges from source to target. The roots are the vertices in roots, or, by
+    default, the vertices without incoming edges. Vertices that are reachable
+    along several paths are placed under the first parent found breadth first.
+    Every parent is centered above its children, and subtrees are placed side
+    by side without overlap, also below wide parents; trees grow downward, or to
+    the right if horizontal is True. Returns the vertices that were placed.
+    """
+    vertices = _layout_vertices(graph, parent)
+    vertices.sort(key=lambda c: c.cell_id)
+    if not vertices:
+        return vertices
+    index = { v.cell_id: i for i, v in enumerate(vertices) }
+    succ, pred = _adjacency(graph, index)
+    if roots is None:
+        root_ids = [ i for i in range(len(vertices)) if not pred[i] ]
+    else:
+        root_ids = [ index[r.cell_id] for r in roots ]
+
+    # breadth first spanning forest; unreached vertices (cycles) become roots
+    children = [ [] for _ in vertices ]
+    level = [ -1 ] * len(vertices)
+    order = []
+    pending = deque(root_ids)
+    for r in root_ids:
+        level[r] = 0
+    forest_roots = list(root_ids)
+    next_unvisited = 0
+    while True:
+        while pending:
+            v = pending.popleft()
+            order.append(v)
+            for t in succ[v]:
+                if level[t] < 0:
+                    level[t] = level[v] + 1
+                    children[v].append(t)
+                    pending.append(t)
+        while next_unvisited < len(vertices) and level[next_unvisited] >= 0:
+            next_unvisited += 1
+        if next_unvisited == len(vertices):
+            break
+        level[next_unvisited] = 0
+        forest_roots.append(next_unvisited)
+        pending.append(next_unvisited)
+
+    sizes = [ _size(v, width, height) for v in vertices ]
+    if horizontal:
+        along = [ h for w, h in sizes ]
+        across = [ w for w, h in sizes ]
+    else:
+        along = [ w for w, h in sizes ]
+        across = [ h for w, h in sizes ]
+    depth_of_level = [0]
+    for v in order:
+        while len(depth_of_level) <= level[v] + 1:
+            depth_of_level.append(0)
+        depth_of_level[level[v] + 1] = max(depth_of_level[level[v] + 1], across[v] + level_spacing)
+    for i in range(1, len(depth_of_level)):
+        depth_of_level[i] += depth_of_level[i - 1]
+
+    # the extent of a subtree is the larger of the vertex and the row of its
+    # children's subtrees; every vertex is centered in its subtree's slot and
+    # its children are centered below it. Reversed pre-order visits children
+    # before their parents.
+    extent = [0.0] * len(vertices)
+    span = [0.0] * len(vertices)
+    start = [0.0] * len(vertices)
+    center = [0.0] * len(vertices)
+    next_pos = 0.0
+    for r in forest_roots:
+        subtree = []
+        pending = [ r ]
+        while pending:
+            v = pending.pop()
+            subtree.append(v)
+            pending.extend(reversed(children[v]))
+        for v in reversed(subtree):
+            if children[v]:
+                span[v] = sum(extent[c] for c in children[v]) + node_spacing * (len(children[v]) - 1)
+            extent[v] = max(along[v], span[v])
+        start[r] = next_pos
+        next_pos += extent[r] + node_spacing
+        for v in subtree:
+            center[v] = start[v] + extent[v] / 2
+            pos = start[v] + (extent[v] - span[v]) / 2
+            for c in children[v]:
+                start[c] = pos
+                pos += extent[c] + node_spacing
+    for v, cell in enumerate(vertices):
+        w, h = sizes[v]
+        pos = center[v] - along[v] / 2
+        depth = depth_of_level[level[v]]
+        if horizontal:
+            _place(cell, depth, pos, w, h)
+        else:
+            _place(cell, pos, depth, w, h)
+    return vertices
@@ -1,11 +1,14 @@
 
 
 import base64
+import sys
+import types
 import urllib.parse
+import weakref
 import zlib
 import defusedxml.ElementTree as dxml
 import xml.etree.ElementTree as ET
-from collections.abc import MutableMapping
+from collections.abc import Mapping, MutableMapping
 
 def int_or_none(a):
     if a is None:
@@ -13,6 +16,29 @@ def int_or_none(a):
     return int(a)
 
 
+def parse_number(a):
+    """Converts the string a to an int if it is a whole number, such as "120"
+    or "120.0", and to a float otherwise, such as "120.5". Returns None if a
+    is None."""
+    if a is None:
+        return a
+    try:
+        return int(a)
+    except ValueError:
+        f = float(a)
+        return int(f) if f.is_integer() else f
+
+
+class NumberTable(dict):
+    """A dictionary that maps coordinate strings to numbers (see
+    parse_number). A string is converted when it is first looked up, so
+    every distinct string is converted only once while a page is read."""
+
+    def __missing__(self, s):
+        n = self[s] = parse_number(s)
+        return n
+
+
 def parse_style_string(s):
     def trysplit(x):
         try:
@@ -27,6 +53,548 @@ def parse_style_string(s):
     kvs = [ trysplit(x) for x in l ]
     return dict(kvs)
 
+# Sentinel for "any value" in queries, and for fields that a cell does not have.
+ANY = object()
+_MISSING = object()
+
+def cell_kind(cell):
+    """Returns 'vertex', 'edge' or 'group' (for cells that are neither, such as the
+    root cell and layers)."""
+    if cell.vertex:
+        return 'vertex'
+    if cell.edge:
+        return 'edge'
+    return 'group'
+
+def _index_key_function(field, name):
+    if field == 'attr':
+        return lambda cell: cell.attrs.get(name, _MISSING)
+    if field == 'style':
+        return lambda cell: _MISSING if cell.style is None else cell.style.attrs.get(name, _MISSING)
+    if field == 'kind':
+        return cell_kind
+    if field == 'parent':
+        return lambda cell: cell._parent_id
+    raise ValueError("unknown index field %r" % field)
+
+
+class CellIndex:
+    """Secondary index on a CellStore. Maps the value of one field of a cell
+    (an attribute, a style key, the cell kind or the parent id) to the
+    identifiers of the cells that have that value.
+    """
+
+    def __init__(self, field, name=None):
+        self.field = field
+        self.name = name
+        self.key_function = _index_key_function(field, name)
+        self.by_value = {}
+        self.by_id = {}
+        self.lookups = 0
+
+    def add(self, cell_id, cell):
+        value = self.key_function(cell)
+        if value is _MISSING:
+            return
+        self.by_id[cell_id] = value
+        self.by_value.setdefault(value, set()).add(cell_id)
+
+    def remove(self, cell_id):
+        value = self.by_id.pop(cell_id, _MISSING)
+        if value is _MISSING:
+            return
+        ids = self.by_value[value]
+        ids.discard(cell_id)
+        if not ids:
+            del self.by_value[value]
+
+    def update(self, cell_id, cell):
+        self.remove(cell_id)
+        self.add(cell_id, cell)
+
+    def lookup(self, value=ANY):
+        """Returns the identifiers of the cells that have value for this field,
+        or of all cells that have this field if value is ANY."""
+        self.lookups += 1
+        if value is ANY:
+            return self.by_id.keys()
+        return self.by_value.get(value, ())
+
+
+class CellQuery:
+    """Base class for cell predicates. Predicates can be combined with
+    &, | and ~. A predicate answers from the indexes of the store if it can,
+    and falls back to scanning all cells otherwise.
+    """
+
+    def __and__(self, other):
+        return AndQuery(self, other)
+
+    def __or__(self, other):
+        return OrQuery(self, other)
+
+    def __invert__(self):
+        return NotQuery(self)
+
+    def matches(self, cell):
+        raise NotImplementedError
+
+    def candidates(self, cell_store):
+        """Returns a collection of cell identifiers that contains at least all
+        matching cells, or None if the indexes cannot narrow it down."""
+        return None
+
+
+class _FieldQuery(CellQuery):
+    field = None
+
+    def __init__(self, name, value=ANY):
+        self.name = name
+        self.value = value
+
+    def _get(self, cell):
+        raise NotImplementedError
+
+    def matches(self, cell):
+        v = self._get(cell)
+        if v is _MISSING:
+            return False
+        return self.value is ANY or v == self.value
+
+    def candidates(self, cell_store):
+        index = cell_store.indexes.get((self.field, self.name))
+        if index is None:
+            return None
+        return index.lookup(self.value)
+
+
+class AttrQuery(_FieldQuery):
+    """Matches cells that have attribute name, with value value if given.
+    An index on the attribute only sees changes made with cell[name] = value;
+    see CellStore.create_index."""
+    field = 'attr'
+
+    def _get(self, cell):
+        return cell.attrs.get(self.name, _MISSING)
+
+
+class StyleQuery(_FieldQuery):
+    """Matches cells whose style has the key name, with value value if given.
+    Style keys without a value (such as 'ellipse') have the value None."""
+    field = 'style'
+
+    def _get(self, cell):
+        if cell.style is None:
+            return _MISSING
+        return cell.style.attrs.get(self.name, _MISSING)
+
+
+class KindQuery(_FieldQuery):
+    """Matches cells of kind 'vertex', 'edge' or 'group'."""
+    field = 'kind'
+
+    def __init__(self, kind):
+        super().__init__(None, kind)
+
+    def _get(self, cell):
+        return cell_kind(cell)
+
+
+class ParentQuery(_FieldQuery):
+    """Matches the direct children of parent (a cell or a cell identifier).
+    Use None for top-level cells."""
+    field = 'parent'
+
+    def __init__(self, parent):
+        if isinstance(parent, MxCell):
+            parent = parent.cell_id
+        super().__init__(None, parent)
+
+    def _get(self, cell):
+        return cell._parent_id
+
+
+class AndQuery(CellQuery):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def matches(self, cell):
+        return all(q.matches(cell) for q in self.queries)
+
+    def candidates(self, cell_store):
+        best = None
+        for q in self.queries:
+            ids = q.candidates(cell_store)
+            if ids is not None and (best is None or len(ids) < len(best)):
+                best = ids
+        return best
+
+
+class OrQuery(CellQuery):
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def matches(self, cell):
+        return any(q.matches(cell) for q in self.queries)
+
+    def candidates(self, cell_store):
+        result = set()
+        for q in self.queries:
+            ids = q.candidates(cell_store)
+            if ids is None:
+                return None
+            result.update(ids)
+        return result
+
+
+class NotQuery(CellQuery):
+    def __init__(self, query):
+        self.query = query
+
+    def matches(self, cell):
+        return not self.query.matches(cell)
+
+
+class ChangeSet:
+    """Describes the changes to a CellStore, as delivered to listeners.
+    added and removed are sets of cell identifiers. changed maps the identifiers
+    of the other changed cells to a set of change kinds: 'attr' (attributes,
+    style or vertex/edge flags), 'geometry' and 'link' (parent, source or
+    target). A cell that was replaced by another cell with the same identifier
+    is both in removed and in added.
+    """
+
+    def __init__(self, added=None, removed=None, changed=None):
+        self.added = added if added is not None else set()
+        self.removed = removed if removed is not None else set()
+        self.changed = changed if changed is not None else {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return 'ChangeSet(added=%r, removed=%r, changed=%r)' % (self.added, self.removed, self.changed)
+
+
+class Transaction:
+    """Buffers the changes to a CellStore and keeps an undo log. Use it through
+    CellStore.transaction() or MxGraph.transaction() as a context manager. On
+    a normal exit the listeners get one coalesced ChangeSet; if the block
+    raises an exception, all changes made in it are undone and the listeners
+    are not called. Transactions can be nested; only the outermost one
+    delivers the changes.
+    """
+
+    def __init__(self, cell_store):
+        self.cell_store = cell_store
+        self.undo_log = []
+        self.touched = {}
+        # (cell_id, kind) for every kind that was added to touched, in order,
+        # with kind None for the entry of a cell itself
+        self.touch_log = []
+        self._outer = None
+        self._savepoint = 0
+        self._touchpoint = 0
+
+    def record(self, kind, cell_id, undo, existed):
+        kinds = self.touched.get(cell_id)
+        if kinds is None:
+            kinds = self.touched[cell_id] = [ existed, set() ]
+            self.touch_log.append((cell_id, None))
+        if kind not in kinds[1]:
+            kinds[1].add(kind)
+            self.touch_log.append((cell_id, kind))
+        if undo is not None:
+            self.undo_log.append(undo)
+
+    def change_set(self):
+        """Returns the coalesced ChangeSet of the changes so far."""
+        cs = ChangeSet()
+        cells = self.cell_store.cells
+        for cell_id, (existed, kinds) in self.touched.items():
+            exists = cell_id in cells
+            if existed and not exists:
+                cs.removed.add(cell_id)
+            elif exists and not existed:
+                cs.added.add(cell_id)
+            elif exists:
+                if 'add' in kinds:
+                    cs.removed.add(cell_id)
+                    cs.added.add(cell_id)
+                else:
+                    cs.changed[cell_id] = kinds - { 'remove' }
+        return cs
+
+    def rollback(self, savepoint=0):
+        """Undoes the changes made after savepoint, an index into the undo log."""
+        store = self.cell_store
+        store._muted = True
+        try:
+            while len(self.undo_log) > savepoint:
+                self.undo_log.pop()()
+        finally:
+            store._muted = False
+
+    def _untouch(self, touchpoint):
+        """Forgets the touched cells and kinds recorded after touchpoint, an
+        index into the touch log."""
+        while len(self.touch_log) > touchpoint:
+            cell_id, kind = self.touch_log.pop()
+            if kind is None:
+                del self.touched[cell_id]
+            else:
+                self.touched[cell_id][1].discard(kind)
+
+    def __enter__(self):
+        store = self.cell_store
+        if store._transaction is None:
+            store._transaction = self
+        else:
+            # nested: record into the outer transaction, remember where we started
+            self._outer = store._transaction
+            self._savepoint = len(self._outer.undo_log)
+            self._touchpoint = len(self._outer.touch_log)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outer is not None:
+            if exc_type is not None:
+                self._outer.rollback(self._savepoint)
+                self._outer._untouch(self._touchpoint)
+            self._outer = None
+            return False
+        if exc_type is not None:
+            self.rollback()
+        self.cell_store._transaction = None
+        if exc_type is None:
+            cs = self.change_set()
+            if cs:
+                self.cell_store._deliver(cs)
+        return False
+
+
+class ValidationProblem:
+    """One problem found by CellStore.validate. kind is one of
+    'dangling-parent', 'dangling-source', 'dangling-target', 'parent-cycle',
+    'vertex-and-edge', 'duplicate-id', 'id-mismatch' and 'missing-geometry'.
+    """
+
+    def __init__(self, kind, cell_id, message):
+        self.kind = kind
+        self.cell_id = cell_id
+        self.message = message
+
+    def __repr__(self):
+        return 'ValidationProblem(%r, %r, %r)' % (self.kind, self.cell_id, self.message)
+
+    def __str__(self):
+        return '%s: %s' % (self.cell_id, self.message)
+
+
+class ValidationResult:
+    """The problems found by CellStore.validate."""
+
+    def __init__(self):
+        self.problems = []
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def add(self, kind, cell_id, message):
+        self.problems.append(ValidationProblem(kind, cell_id, message))
+
+    def by_kind(self, kind):
+        """Returns the problems of kind kind."""
+        return [ p for p in self.problems if p.kind == kind ]
+
+    def __iter__(self):
+        return iter(self.problems)
+
+    def __len__(self):
+        return len(self.problems)
+
+
+class ValidationError(Exception):
+    """Raised when a graph that is loaded with validation has problems. The
+    ValidationResult is in the result attribute."""
+
+    def __init__(self, result):
+        lines = [ str(p) for p in result.problems[:10] ]
+        if len(result.problems) > 10:
+            lines.append('... and %d more' % (len(result.problems) - 10))
+        super().__init__('invalid graph:\n' + '\n'.join(lines))
+        self.result = result
+
+
+# Marks a cell that did not exist when a snapshot was taken.
+_ABSENT = object()
+
+
+class FrozenCell(Mapping):
+    """Read-only copy of an MxCell, as found in a CellStoreSnapshot. It has the
+    same attributes and properties as MxCell, but its parent, source and target
+    are looked up in the snapshot, and its attributes, style and geometry can
+    not be changed. A frozen cell refers to its snapshot weakly, so that
+    dropping the snapshot frees it (and stops the store from saving cells
+    for it) at once; looking up related cells then raises ReferenceError.
+    """
+
+    def __init__(self, cell_id, attrs, style, geometry, vertex, edge, parent_id, source_id, target_id, snapshot=None):
+        self.cell_id = cell_id
+        self.attrs = attrs
+        self.style = style
+        self.geometry = geometry
+        self.vertex = vertex
+        self.edge = edge
+        self._parent_id = parent_id
+        self._source_id = source_id
+        self._target_id = target_id
+        self._snapshot = None if snapshot is None else weakref.ref(snapshot)
+
+    @property
+    def snapshot(self):
+        """The CellStoreSnapshot that this cell belongs to, or None."""
+        return None if self._snapshot is None else self._snapshot()
+
+    @classmethod
+    def freeze(cls, cell):
+        style = cell.style
+        if style is not None:
+            style = style.copy()
+            style._frozen = True
+        geometry = cell.geometry
+        if geometry is not None:
+            geometry = geometry.copy()
+            geometry.points = tuple(geometry.points)
+            geometry._frozen = True
+        return FrozenCell(cell.cell_id, types.MappingProxyType(dict(cell.attrs)), style, geometry,
+                cell.vertex, cell.edge, cell._parent_id, cell._source_id, cell._target_id)
+
+    def bind(self, snapshot):
+        """Returns this frozen cell as seen from snapshot."""
+        return FrozenCell(self.cell_id, self.attrs, self.style, self.geometry, self.vertex, self.edge,
+                self._parent_id, self._source_id, self._target_id, snapshot)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    def __iter__(self):
+        return iter(self.attrs)
+
+    def __len__(self):
+        return len(self.attrs)
+
+    def _lookup(self, cell_id):
+        if cell_id is None:
+            return None
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise ReferenceError('the snapshot of cell %s is gone' % self.cell_id)
+        return snapshot[cell_id]
+
+    @property
+    def parent(self):
+        return self._lookup(self._parent_id)
+
+    @property
+    def source(self):
+        return self._lookup(self._source_id)
+
+    @property
+    def target(self):
+        return self._lookup(self._target_id)
+
+    def to_xml(self):
+        return MxCell.to_xml(self)
+
+
+class CellStoreSnapshot(Mapping):
+    """Read-only view of a CellStore at the moment CellStore.snapshot was
+    called, mapping identifiers to FrozenCells. Reading a snapshot never
+    waits for the thread that changes the store: that thread saves the old
+    state of a cell in the snapshot before it changes the cell, and a reader
+    that copies a live cell checks afterwards whether the cell was saved in
+    the meantime.
+    """
+
+    def __init__(self, cell_store):
+        self.cell_store = cell_store
+        self._overlay = {}
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        cell = self._overlay.get(key)
+        if cell is None:
+            cell = self._cache.get(key)
+            if cell is not None:
+                self.hits += 1
+                return cell
+            self.misses += 1
+            live = self.cell_store.cells.get(key)
+            frozen = None if live is None else FrozenCell.freeze(live)
+            # the writer saves a cell before it changes it, so if the cell has
+            # not been saved by now, the copy was made from unchanged state
+            cell = self._overlay.get(key)
+            if cell is None:
+                if frozen is None:
+                    raise KeyError(key)
+                cell = frozen.bind(self)
+                self._cache[key] = cell
+                return cell
+        if cell is _ABSENT:
+            raise KeyError(key)
+        cell = cell.bind(self)
+        self._cache[key] = cell
+        return cell
+
+    def _keys(self):
+        keys = list(self.cell_store.cells)
+        seen = set(keys)
+        for key, cell in list(self._overlay.items()):
+            if key not in seen:
+                keys.append(key)
+        return keys
+
+    def __iter__(self):
+        for key in self._keys():
+            try:
+                self[key]
+            except KeyError:
+                continue
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _rate(hits, total):
+    return hits / total if total else 0.0
+
+
+def _dict_size(d):
+    return sys.getsizeof(d) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in d.items())
+
+
+def _object_size(obj):
+    return sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+
+
+def _point_size(p):
+    return _object_size(p) + sys.getsizeof(p.attrs) + sys.getsizeof(p.x) + sys.getsizeof(p.y)
+
+
+def _geometry_size(g):
+    size = _object_size(g) + sys.getsizeof(g.attrs) + sys.getsizeof(g.points)
+    size += sum(_point_size(p) for p in g.points)
+    for p in (g.source_point, g.target_point):
+        if p is not None:
+            size += _point_size(p)
+    return size
+
+
 class CellStore(MutableMapping):
     """Keeps track of cells in a graph. The store will give every edge a unique id."""
 
@@ -35,6 +603,13 @@ class CellStore(MutableMapping):
         self.cells = {}
         self.prefix = ''
         self.postfix = ''
+        self.indexes = {}
+        self.listeners = []
+        self._transaction = None
+        self._muted = False
+        self._snapshots = []
+        self.queries = 0
+        self.indexed_queries = 0
 
     def __make_id(self, n):
         s = ''
@@ -53,14 +628,41 @@ class CellStore(MutableMapping):
             newid = self.__make_id(self.current_id)
         return newid
 
+    def new_ids(self, n, reserved=()):
+        """Return a list of n new identifiers that are not used yet, and that
+        are not in reserved."""
+        ids = []
+        while len(ids) < n:
+            newid = self.__make_id(self.current_id)
+            self.current_id += 1
+            if newid not in self.cells and newid not in reserved:
+                ids.append(newid)
+        return ids
+
     def __getitem__(self, key):
         return self.cells[key]
 
     def __setitem__(self, key, value):
+        if self._snapshots:
+            self._preserve(key)
+        old = self.cells.get(key)
         self.cells[key] = value
+        for index in self.indexes.values():
+            index.update(key, value)
+        if self._transaction is None and not self.listeners:
+            return
+        if old is None:
+            self._notify('add', key, lambda: self.__delitem__(key), existed=False)
+        else:
+            self._notify('add', key, lambda: self.__setitem__(key, old))
 
     def __delitem__(self, key):
-        del self.cells[key]
+        if self._snapshots:
+            self._preserve(key)
+        old = self.cells.pop(key)
+        for index in self.indexes.values():
+            index.remove(key)
+        self._notify('remove', key, lambda: self.__setitem__(key, old))
 
     def __iter__(self):
         return iter(self.cells)
@@ -70,7 +672,237 @@ class CellStore(MutableMapping):
 
     def add_cell(self, cell):
         """Adds the cell cell to the store. It is stored under its cell_id."""
-        self.cells[cell.cell_id] = cell
+        self[cell.cell_id] = cell
+
+    def create_index(self, field, name=None):
+        """Declares a secondary index on field, which is one of 'attr' or 'style'
+        (with name the attribute or style key), 'kind' or 'parent'. The index is
+        kept up to date when cells are added, removed or changed, and is used by
+        query(). Returns the index.
+        Only changes made through the cells are seen: cell[key] = value, del
+        cell[key], cell.style[key] = value and the cell's properties. Changing
+        the dictionaries cell.attrs or cell.style.attrs directly bypasses the
+        indexes (and the listeners and snapshots), so query() may then give
+        different results with and without an index.
+        """
+        key = (field, name)
+        index = self.indexes.get(key)
+        if index is None:
+            index = CellIndex(field, name)
+            for cell_id, cell in self.cells.items():
+                index.add(cell_id, cell)
+            self.indexes[key] = index
+        return index
+
+    def drop_index(self, field, name=None):
+        """Removes the index on field."""
+        del self.indexes[(field, name)]
+
+    def snapshot(self):
+        """Returns a CellStoreSnapshot, a read-only view of the cells as they
+        are now. This takes constant time: the store keeps a frozen copy of a
+        cell only when the cell is changed while the snapshot is alive.
+        Take snapshots from the thread that changes the store.
+        Only changes that the store sees are kept out of the snapshot:
+        changing the points list of a geometry in place, or an MxPoint in
+        it, also changes the snapshot. Assign a new points list (with new
+        points) to the geometry instead.
+        """
+        snap = CellStoreSnapshot(self)
+        self._snapshots.append(weakref.ref(snap))
+        return snap
+
+    def _preserve(self, key):
+        """Called before the cell stored under key changes, to give the live
+        snapshots that do not have a copy of it yet the old state."""
+        frozen = None
+        alive = []
+        for ref in self._snapshots:
+            snap = ref()
+            if snap is None:
+                continue
+            alive.append(ref)
+            if key not in snap._overlay:
+                if frozen is None:
+                    cell = self.cells.get(key)
+                    frozen = _ABSENT if cell is None else FrozenCell.freeze(cell)
+                snap._overlay[key] = frozen
+        if len(alive) != len(self._snapshots):
+            self._snapshots = alive
+
+    def _before_change(self, cell):
+        if self.cells.get(cell.cell_id) is cell:
+            self._preserve(cell.cell_id)
+
+    def add_listener(self, listener):
+        """Registers listener, a function that is called with a ChangeSet after
+        every change, or once at the end of a transaction."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def transaction(self):
+        """Returns a Transaction context manager that batches the changes made
+        within it into one ChangeSet, and undoes them on an exception."""
+        return Transaction(self)
+
+    def _tracking(self):
+        return bool(self.indexes or self.listeners or self._transaction is not None)
+
+    def _notify(self, kind, cell_id, undo, existed=True):
+        if self._muted:
+            return
+        if self._transaction is not None:
+            self._transaction.record(kind, cell_id, undo, existed)
+        elif self.listeners:
+            t = Transaction(self)
+            t.record(kind, cell_id, None, existed)
+            self._deliver(t.change_set())
+
+    def _deliver(self, change_set):
+        for listener in list(self.listeners):
+            listener(change_set)
+
+    def _cell_changed(self, cell, kind, undo):
+        if self.cells.get(cell.cell_id) is not cell:
+            return
+        for index in self.indexes.values():
+            index.update(cell.cell_id, cell)
+        self._notify(kind, cell.cell_id, undo)
+
+    def validate(self, duplicate_ids=()):
+        """Checks all cells in one pass and returns a ValidationResult with
+        every dangling parent, source or target reference, parent cycle,
+        cell that is both a vertex and an edge, cell stored under another
+        identifier than its own and vertex or edge without geometry.
+        duplicate_ids are identifiers that were seen more than once while
+        loading, and are reported as well.
+        """
+        result = ValidationResult()
+        cells = self.cells
+        for cell_id in duplicate_ids:
+            result.add('duplicate-id', cell_id, 'identifier is used more than once')
+        for key, cell in cells.items():
+            if cell.cell_id != key:
+                result.add('id-mismatch', key, 'cell with identifier %r is stored under %r' % (cell.cell_id, key))
+            if cell._parent_id is not None and cell._parent_id not in cells:
+                result.add('dangling-parent', key, 'parent %r does not exist' % cell._parent_id)
+            if cell._source_id is not None and cell._source_id not in cells:
+                result.add('dangling-source', key, 'source %r does not exist' % cell._source_id)
+            if cell._target_id is not None and cell._target_id not in cells:
+                result.add('dangling-target', key, 'target %r does not exist' % cell._target_id)
+            if cell.vertex and cell.edge:
+                result.add('vertex-and-edge', key, 'cell is both a vertex and an edge')
+            if (cell.vertex or cell.edge) and cell.geometry is None:
+                result.add('missing-geometry', key, '%s has no geometry' % cell_kind(cell))
+
+        # every cell is visited once: walk up until a cell of an earlier walk
+        walk_of = {}
+        for walk, start in enumerate(cells):
+            cell_id = start
+            while cell_id in cells and cell_id not in walk_of:
+                walk_of[cell_id] = walk
+                cell_id = cells[cell_id]._parent_id
+            if walk_of.get(cell_id) == walk:
+                cycle = [ cell_id ]
+                c = cells[cell_id]._parent_id
+                while c != cell_id:
+                    cycle.append(c)
+                    c = cells[c]._parent_id
+                result.add('parent-cycle', cell_id, 'parent cycle: %s' % ' -> '.join(cycle + [ cell_id ]))
+        return result
+
+    def stats(self, sample=1000):
+        """Returns a dict with the number of cells, vertices, edges, waypoints
+        and (distinct) styles, estimated memory use in bytes, and the sizes
+        and hit rates of the indexes and of the caches of live snapshots.
+        The counts take one pass over the cells; the memory use is estimated
+        from at most sample cells, spread over the store. Lookup and hit
+        counters count from the creation of the index, store or snapshot.
+        """
+        cells = list(self.cells.values())
+        vertices = edges = waypoints = styles = 0
+        distinct_styles = set()
+        for cell in cells:
+            if cell._vertex:
+                vertices += 1
+            elif cell._edge:
+                edges += 1
+            if cell._geometry is not None:
+                waypoints += len(cell._geometry.points)
+            if cell._style is not None:
+                styles += 1
+                distinct_styles.add(frozenset(cell._style.attrs.items()))
+
+        sizes = { 'cells': 0, 'attrs': 0, 'styles': 0, 'geometry': 0 }
+        if cells:
+            picked = cells[::max(1, len(cells) // sample)]
+            for cell in picked:
+                sizes['cells'] += _object_size(cell)
+                sizes['attrs'] += _dict_size(cell.attrs)
+                if cell._style is not None:
+                    sizes['styles'] += _object_size(cell._style) + _dict_size(cell._style.attrs)
+                if cell._geometry is not None:
+                    sizes['geometry'] += _geometry_size(cell._geometry)
+            scale = len(cells) / len(picked)
+            sizes = dict((k, int(v * scale)) for k, v in sizes.items())
+        sizes['store'] = sys.getsizeof(self.cells)
+
+        indexes = {}
+        for (field, name), index in self.indexes.items():
+            size = sys.getsizeof(index.by_id) + sys.getsizeof(index.by_value)
+            size += sum(sys.getsizeof(ids) for ids in index.by_value.values())
+            indexes[field if name is None else '%s:%s' % (field, name)] = {
+                'entries': len(index.by_id),
+                'values': len(index.by_value),
+                'lookups': index.lookups,
+                'bytes': size,
+            }
+        sizes['indexes'] = sum(i['bytes'] for i in indexes.values())
+
+        snapshots = [ snap for snap in (ref() for ref in self._snapshots) if snap is not None ]
+        hits = sum(snap.hits for snap in snapshots)
+        misses = sum(snap.misses for snap in snapshots)
+        snapshot_stats = {
+            'alive': len(snapshots),
+            'saved': sum(len(snap._overlay) for snap in snapshots),
+            'cached': sum(len(snap._cache) for snap in snapshots),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': _rate(hits, hits + misses),
+        }
+        sizes['snapshots'] = sum(sys.getsizeof(snap._overlay) + sys.getsizeof(snap._cache) for snap in snapshots)
+        sizes['total'] = sum(sizes.values())
+
+        return {
+            'cells': len(cells),
+            'vertices': vertices,
+            'edges': edges,
+            'waypoints': waypoints,
+            'styles': styles,
+            'distinct_styles': len(distinct_styles),
+            'bytes': sizes,
+            'indexes': indexes,
+            'queries': {
+                'total': self.queries,
+                'indexed': self.indexed_queries,
+                'hit_rate': _rate(self.indexed_queries, self.queries),
+            },
+            'snapshots': snapshot_stats,
+        }
+
+    def query(self, query):
+        """Returns a list of the cells that match the CellQuery query, in no
+        particular order.
+        """
+        ids = query.candidates(self)
+        self.queries += 1
+        if ids is None:
+            return [ c for c in self.cells.values() if query.matches(c) ]
+        self.indexed_queries += 1
+        cells = self.cells
+        return [ cells[i] for i in ids if query.matches(cells[i]) ]
 
 
 
@@ -96,7 +928,41 @@ class MxBase(MutableMapping):
         return len(self.attrs)
 
 
-class MxStyle(MxBase):
+class _Owned:
+    """Keeps the cells that use a style or geometry; changing it changes
+    them. Most styles and geometries belong to a single cell, which is kept
+    in _owner without a container. The other cells that share it are kept in
+    _shared, a dictionary by id, so that adding and removing owners takes
+    constant time however many cells share it."""
+
+    _owner = None
+    _shared = None
+
+    @property
+    def _owners(self):
+        if self._owner is None:
+            return ()
+        if not self._shared:
+            return (self._owner,)
+        return (self._owner,) + tuple(self._shared.values())
+
+    def _add_owner(self, cell):
+        if self._owner is None:
+            object.__setattr__(self, '_owner', cell)
+            return
+        if self._shared is None:
+            object.__setattr__(self, '_shared', {})
+        self._shared[id(cell)] = cell
+
+    def _remove_owner(self, cell):
+        if self._owner is cell:
+            owner = self._shared.popitem()[1] if self._shared else None
+            object.__setattr__(self, '_owner', owner)
+        elif self._shared:
+            self._shared.pop(id(cell), None)
+
+
+class MxStyle(_Owned, MxBase):
     """Stores style attributes."""
 
     def __init__(self, **kwargs):
@@ -104,12 +970,45 @@ class MxStyle(MxBase):
         the style string without a value will have the value None in Python."""
         self.attrs = kwargs
 
+    def __setitem__(self, key, value):
+        self._before_change()
+        old = self.attrs.get(key, _MISSING)
+        self.attrs[key] = value
+        self._changed(key, old)
+
+    def __delitem__(self, key):
+        self._before_change()
+        old = self.attrs.pop(key)
+        self._changed(key, old)
+
+    _frozen = False
+
+    def _before_change(self):
+        if self._frozen:
+            raise TypeError('style of a snapshot cell can not be changed')
+        for cell in self._owners:
+            if cell.cell_store._snapshots:
+                cell.cell_store._before_change(cell)
+
+    def _restore(self, key, old):
+        if old is _MISSING:
+            del self[key]
+        else:
+            self[key] = old
+
+    def _changed(self, key, old):
+        for cell in self._owners:
+            cell._changed('attr', lambda: self._restore(key, old))
+
     @classmethod
     def from_string(cls, s):
         mxstyle = MxStyle()
         mxstyle.attrs = parse_style_string(s)
         return mxstyle
 
+    def copy(self):
+        return MxStyle(**self.attrs)
+
     def to_string(self):
         shapes = [ k+';' for k,v in self.attrs.items() if v is None ]
         styles = [ k+'='+str(v)+';' for k,v in self.attrs.items() if v is not None ]
@@ -126,51 +1025,115 @@ class MxPoint(MxBase):
         self.y = y
 
     @classmethod
-    def from_xml(cls, cell_store, xml_element):
-        x = int(xml_element.get('x'))
-        y = int(xml_element.get('y'))
-        point = MxPoint(x,y)
+    def from_xml(cls, cell_store, xml_element, numbers=None):
+        """Reads a point. Coordinates may be fractional, and a missing
+        coordinate is 0. numbers is an optional NumberTable to share with the
+        other elements of a page."""
+        if numbers is None:
+            numbers = NumberTable()
+        x = numbers[xml_element.get('x')]
+        y = numbers[xml_element.get('y')]
+        point = MxPoint(x or 0, y or 0)
         point.attrs.update(xml_element.items())
         return point
 
+    def copy(self, dx=0, dy=0):
+        """Returns a copy of this point, moved by (dx, dy)."""
+        point = MxPoint(self.x + dx, self.y + dy)
+        point.attrs.update(self.attrs)
+        return point
+
     def to_xml(self):
         point_xml = ET.Element('mxPoint')
         point_xml.set('x', str(self.x))
         point_xml.set('y', str(self.y))
         return point_xml
 
-class MxGeometry(MxBase):
+class MxGeometry(_Owned, MxBase):
     """Represents an mxGeometry element.
     https://jgraph.github.io/mxgraph/docs/js-api/files/model/mxGeometry-js.html
     """
 
     def __init__(self, x=None, y=None, width=None, height=None, relative=False):
-        super().__init__()
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
-        self.relative = relative
-        self.points = []
-        self.source_point = None
-        self.target_point = None
+        # a new geometry has no owners, so there is nothing to track. The
+        # fields are set one by one, in a fixed order, so that all geometries
+        # share the keys of their attribute dictionaries.
+        set_field = object.__setattr__
+        set_field(self, 'attrs', {})
+        set_field(self, 'x', x)
+        set_field(self, 'y', y)
+        set_field(self, 'width', width)
+        set_field(self, 'height', height)
+        set_field(self, 'relative', relative)
+        set_field(self, 'points', [])
+        set_field(self, 'source_point', None)
+        set_field(self, 'target_point', None)
+
+    _frozen = False
+
+    def __setattr__(self, name, value):
+        """Setting an attribute of a geometry that belongs to a cell counts as a
+        geometry change of that cell. Changing the points list in place does
+        not; assign a new list instead."""
+        if self._frozen:
+            raise TypeError('geometry of a snapshot cell can not be changed')
+        if self._owner is None:
+            object.__setattr__(self, name, value)
+            return
+        owners = self._owners
+        for cell in owners:
+            if cell.cell_store._snapshots:
+                cell.cell_store._before_change(cell)
+        old = self.__dict__.get(name, _MISSING)
+        object.__setattr__(self, name, value)
+        for cell in owners:
+            cell._changed('geometry', lambda: self._restore(name, old))
+
+    def _restore(self, name, old):
+        if old is _MISSING:
+            object.__delattr__(self, name)
+        else:
+            setattr(self, name, old)
+
+    def copy(self, dx=0, dy=0):
+        """Returns a copy of this geometry. If dx or dy is given, the copy is
+        moved by (dx, dy): its position if it is not relative, and its points."""
+        geom = MxGeometry(self.x, self.y, self.width, self.height, self.relative)
+        geom.attrs.update(self.attrs)
+        if (dx or dy) and not self.relative:
+            geom.x = (self.x or 0) + dx
+            geom.y = (self.y or 0) + dy
+        geom.points = [ p.copy(dx, dy) for p in self.points ]
+        if self.source_point is not None:
+            geom.source_point = self.source_point.copy(dx, dy)
+        if self.target_point is not None:
+            geom.target_point = self.target_point.copy(dx, dy)
+        return geom
 
     @classmethod
-    def from_xml(cls, cell_store, xml_element):
+    def from_xml(cls, cell_store, xml_element, numbers=None):
+        """Reads a geometry. Coordinates and sizes may be fractional. numbers
+        is an optional NumberTable to share with the other elements of a
+        page."""
+        if numbers is None:
+            numbers = NumberTable()
         geom = MxGeometry(
-                int_or_none(xml_element.get('x')),
-                int_or_none(xml_element.get('y')),
-                int_or_none(xml_element.get('width')),
-                int_or_none(xml_element.get('height')),
+                numbers[xml_element.get('x')],
+                numbers[xml_element.get('y')],
+                numbers[xml_element.get('width')],
+                numbers[xml_element.get('height')],
                 xml_element.get('relative') == '1')
-        points = [ MxPoint.from_xml(cell_store, p) for p in xml_element.findall('Array/mxPoint') ]
-        geom.points = points
-        sp_xml = xml_element.find("mxPoint[@as='sourcePoint']")
-        if sp_xml is not None:
-            geom.source_point = MxPoint.from_xml(cell_store, sp_xml)
-        tp_xml = xml_element.find("mxPoint[@as='targetPoint']")
-        if tp_xml is not None:
-            geom.target_point = MxPoint.from_xml(cell_store, tp_xml)
+        # the geometry has no owners yet, so its fields are set directly
+        set_field = object.__setattr__
+        for child in xml_element:
+            if child.tag == 'Array':
+                geom.points.extend(MxPoint.from_xml(cell_store, p, numbers) for p in child if p.tag == 'mxPoint')
+            elif child.tag == 'mxPoint':
+                role = child.get('as')
+                if role == 'sourcePoint':
+                    set_field(geom, 'source_point', MxPoint.from_xml(cell_store, child, numbers))
+                elif role == 'targetPoint':
+                    set_field(geom, 'target_point', MxPoint.from_xml(cell_store, child, numbers))
         return geom
 
     def to_xml(self):
@@ -212,16 +1175,98 @@ class MxCell(MxBase):
         self.cell_id = cell_id
         self._parent_id = None
         # self.value = None
-        self.geometry = None
-        self.style = None
-        self.vertex = vertex
-        self.edge = edge
+        self._geometry = None
+        self._style = None
+        self._vertex = vertex
+        self._edge = edge
         # self.connectable = False
         # self.collapsed = False
         self._source_id = None
         self._target_id = None
         self.attrs.update(kwargs)
 
+    def __setitem__(self, key, value):
+        if self.cell_store._snapshots:
+            self.cell_store._before_change(self)
+        old = self.attrs.get(key, _MISSING)
+        self.attrs[key] = value
+        self._changed('attr', lambda: self._restore_attr(key, old))
+
+    def __delitem__(self, key):
+        if self.cell_store._snapshots:
+            self.cell_store._before_change(self)
+        old = self.attrs.pop(key)
+        self._changed('attr', lambda: self._restore_attr(key, old))
+
+    def _restore_attr(self, key, old):
+        if old is _MISSING:
+            del self[key]
+        else:
+            self[key] = old
+
+    def _changed(self, kind, undo):
+        """Called after the cell has been changed, to keep the indexes of the
+        cell store up to date and to notify its listeners. kind is the kind of
+        change and undo a function that reverts it."""
+        if self.cell_store._tracking():
+            self.cell_store._cell_changed(self, kind, undo)
+
+    def _set_tracked(self, name, value, kind, undo=None):
+        """Sets the field name to value as a change of kind. undo, a function
+        of the old value, reverts the change; by default, it sets the field
+        back."""
+        if self.cell_store._snapshots:
+            self.cell_store._before_change(self)
+        old = getattr(self, name)
+        object.__setattr__(self, name, value)
+        if undo is None:
+            self._changed(kind, lambda: self._set_tracked(name, old, kind))
+        else:
+            self._changed(kind, lambda: undo(old))
+        return old
+
+    @property
+    def style(self):
+        """The cell's MxStyle, or None."""
+        return self._style
+
+    @style.setter
+    def style(self, style):
+        if self._style is not None:
+            self._style._remove_owner(self)
+        if style is not None:
+            style._add_owner(self)
+        self._set_tracked('_style', style, 'attr', lambda old: setattr(self, 'style', old))
+
+    @property
+    def geometry(self):
+        """The cell's MxGeometry, or None."""
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, geometry):
+        if self._geometry is not None:
+            self._geometry._remove_owner(self)
+        if geometry is not None:
+            geometry._add_owner(self)
+        self._set_tracked('_geometry', geometry, 'geometry', lambda old: setattr(self, 'geometry', old))
+
+    @property
+    def vertex(self):
+        return self._vertex
+
+    @vertex.setter
+    def vertex(self, vertex):
+        self._set_tracked('_vertex', vertex, 'attr')
+
+    @property
+    def edge(self):
+        return self._edge
+
+    @edge.setter
+    def edge(self, edge):
+        self._set_tracked('_edge', edge, 'attr')
+
     @property
     def parent(self):
         """Returns the cell's parent cell, and None if this is
@@ -234,13 +1279,10 @@ class MxCell(MxBase):
     @parent.setter
     def parent(self, cell):
         """Set the cell's parent to cell."""
-        if cell is not None:
-            self._parent_id = cell.cell_id
-        else:
-            self._parent_id = None
+        self._set_tracked('_parent_id', None if cell is None else cell.cell_id, 'link')
 
     @classmethod
-    def from_xml(cls, cell_store, xml_element):
+    def from_xml(cls, cell_store, xml_element, numbers=None):
         # https://jgraph.github.io/mxgraph/docs/js-api/files/model/mxCell-js.html
         if False and xml_element.get('vertex'):
             cell = MxVertexCell.from_xml(cell_store, xml_element)
@@ -251,18 +1293,19 @@ class MxCell(MxBase):
         cell.cell_id = xml_element.get('id')
         cell._parent_id = xml_element.get('parent')
         cell.attrs = dict(xml_element.items())
-        
-        if xml_element.get('style') is not None:
-            cell.style = MxStyle.from_string(xml_element.get('style'))
+        # the cell is not in the store yet, so there is nothing to track
+        style = xml_element.get('style')
+        if style is not None:
+            cell._style = MxStyle.from_string(style)
+            cell._style._owner = cell
         geom = xml_element.find('mxGeometry')
         if geom is not None:
-            cell.geometry = MxGeometry.from_xml(cell_store, geom)
-        if xml_element.get('source') is not None:
-            cell._source_id = xml_element.get('source')
-        if xml_element.get('target') is not None:
-            cell._target_id = xml_element.get('target')
-        cell.vertex = xml_element.get('vertex') == '1'
-        cell.edge = xml_element.get('edge') == '1'
+            cell._geometry = MxGeometry.from_xml(cell_store, geom, numbers)
+            object.__setattr__(cell._geometry, '_owner', cell)
+        cell._source_id = xml_element.get('source')
+        cell._target_id = xml_element.get('target')
+        cell._vertex = xml_element.get('vertex') == '1'
+        cell._edge = xml_element.get('edge') == '1'
         return cell
 
     def to_xml(self):
@@ -299,7 +1342,7 @@ class MxCell(MxBase):
     @source.setter
     def source(self, cell):
         """Sets the source cell of an edge cell to cell."""
-        self._source_id = cell.cell_id
+        self._set_tracked('_source_id', cell.cell_id, 'link')
 
     @property
     def target(self):
@@ -313,7 +1356,56 @@ class MxCell(MxBase):
     @target.setter
     def target(self, cell):
         """Sets the target cell of an edge cell to cell."""
-        self._target_id = cell.cell_id
+        self._set_tracked('_target_id', cell.cell_id, 'link')
+
+
+def select_cells(records, parents):
+    """Decides which cells to load when only the cells under parents (a set of
+    cell identifiers, such as layers or groups) are wanted. records is an
+    iterable of (id, parent, source, target) tuples for all cells. Returns the
+    set of identifiers of the parents, all cells whose parent chain reaches
+    one of the parents, and all edges that have one of these cells as source
+    or target. So that the loaded cells refer only to loaded cells, the set
+    also holds the ancestors and the source and target of every cell in it:
+    an edge to a cell on another layer brings that cell and its layer along.
+    """
+    records = list(records)
+    parent_of = { r[0]: r[1] for r in records }
+    parents = set(parents)
+    under = {}
+    for cell_id in parent_of:
+        path = []
+        c = cell_id
+        while c not in under:
+            if c in parents:
+                under[c] = True
+                break
+            p = parent_of.get(c)
+            if p is None or c in path:
+                under[c] = False
+                break
+            path.append(c)
+            c = p
+        result = under[c]
+        for c in path:
+            under[c] = result
+    subtree = set(c for c, u in under.items() if u and c in parent_of)
+    ends = {}
+    pending = list(subtree)
+    for cell_id, parent_id, source_id, target_id in records:
+        if source_id is not None or target_id is not None:
+            ends[cell_id] = (source_id, target_id)
+            if source_id in subtree or target_id in subtree:
+                pending.append(cell_id)
+    keep = set()
+    while pending:
+        c = pending.pop()
+        if c in keep or c not in parent_of:
+            continue
+        keep.add(c)
+        pending.append(parent_of[c])
+        pending.extend(ends.get(c, ()))
+    return keep
 
 
 class MxGraphModel(MxBase):
@@ -325,13 +1417,84 @@ class MxGraphModel(MxBase):
         super().__init__()
 
     @classmethod
-    def from_xml(cls, cell_store, xml_element):
+    def from_xml(cls, cell_store, xml_element, validate=False, parents=None):
+        """Reads the model and adds its cells to cell_store. If validate is True,
+        the cells are checked with CellStore.validate after loading, and a
+        ValidationError is raised if there are problems. If parents is given,
+        only the cells under these cell identifiers are built (see
+        select_cells); the other mxCell elements are skipped after reading
+        their id, parent, source and target attributes.
+        """
         gm = MxGraphModel()
         gm.attrs = dict(xml_element.items())
-        for x in xml_element.findall('root/mxCell'):
-            cell_store.add_cell(MxCell.from_xml(cell_store, x))
+        cells_xml = xml_element.findall('root/mxCell')
+        if parents is not None:
+            keep = select_cells(((x.get('id'), x.get('parent'), x.get('source'), x.get('target')) for x in cells_xml), parents)
+            cells_xml = [ x for x in cells_xml if x.get('id') in keep ]
+        gm._add_cells(cell_store, cells_xml, validate)
         return gm
 
+    @classmethod
+    def from_stream(cls, cell_store, source, validate=False, parents=None):
+        """Like from_xml, but reads an mxGraphModel document incrementally from
+        source, a file name or file object, without building the element tree
+        of the whole document. This is slower than from_xml, but uses little
+        memory beyond the cells that are built. If parents is given, source is
+        read twice: once to find the cells to keep, and once to build them. A
+        file object must then be seekable.
+        """
+        keep = None
+        if parents is not None:
+            keep = select_cells(((x.get('id'), x.get('parent'), x.get('source'), x.get('target')) for model, x in cls._iter_cells(source)), parents)
+            if hasattr(source, 'seek'):
+                source.seek(0)
+        gm = MxGraphModel()
+        def cells_xml():
+            for model, x in cls._iter_cells(source):
+                gm.attrs = dict(model.items())
+                if keep is None or x.get('id') in keep:
+                    yield x
+        gm._add_cells(cell_store, cells_xml(), validate)
+        return gm
+
+    @staticmethod
+    def _iter_cells(source):
+        """Yields (model element, mxCell element) for every mxCell directly
+        under mxGraphModel/root, dropping each cell's element after use."""
+        depth = 0
+        model = root = None
+        for event, elem in dxml.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    model = elem
+                elif depth == 2 and elem.tag == 'root':
+                    root = elem
+                continue
+            depth -= 1
+            if depth == 2 and elem.tag == 'mxCell' and root is not None:
+                yield model, elem
+                root.clear()
+            elif depth == 1:
+                root = None
+
+    def _add_cells(self, cell_store, cells_xml, validate):
+        # every distinct coordinate string is converted once, as it is read
+        numbers = NumberTable()
+        seen = set()
+        duplicate_ids = []
+        for x in cells_xml:
+            cell = MxCell.from_xml(cell_store, x, numbers)
+            if validate:
+                if cell.cell_id in seen:
+                    duplicate_ids.append(cell.cell_id)
+                seen.add(cell.cell_id)
+            cell_store.add_cell(cell)
+        if validate:
+            result = cell_store.validate(duplicate_ids)
+            if not result.ok:
+                raise ValidationError(result)
+
     def to_xml(self, cell_store):
         g_xml = ET.Element('mxGraphModel')
         for k,v in self.attrs.items():
@@ -420,8 +1583,171 @@ class MxGraph:
         integer pair."""
         edge.geometry.target_point = MxPoint(*point)
 
+    def absolute_bounds(self, cell):
+        """Returns the bounds (x, y, width, height) of cell in page coordinates,
+        adding the offsets of the parent cells that have a geometry. Returns
+        None if the cell has no geometry or a relative (edge) geometry.
+        """
+        g = cell.geometry
+        if g is None or g.relative:
+            return None
+        x, y = self.origin(self.cells.cells.get(cell._parent_id))
+        return (x + (g.x or 0), y + (g.y or 0), g.width or 0, g.height or 0)
+
+    def origin(self, cell):
+        """Returns the page position (x, y) of the coordinate system of the
+        children of cell: the sum of the positions of cell and its ancestors
+        that have a geometry that is not relative. Cells without a geometry,
+        such as layers, do not move their children. Returns (0, 0) if cell
+        is None.
+        """
+        x = y = 0
+        while cell is not None:
+            g = cell.geometry
+            if g is not None and not g.relative:
+                x += g.x or 0
+                y += g.y or 0
+            cell = self.cells.cells.get(cell._parent_id)
+        return (x, y)
+
+    def transaction(self):
+        """Returns a context manager that batches all changes to the graph made
+        within it, like beginUpdate/endUpdate in mxGraph. See Transaction."""
+        return self.cells.transaction()
+
+    def add_listener(self, listener):
+        """Registers listener to be called with a ChangeSet when cells change.
+        See CellStore.add_listener."""
+        self.cells.add_listener(listener)
+
+    def remove_listener(self, listener):
+        self.cells.remove_listener(listener)
+
+    def merge(self, other, parent=None, offset=(0, 0), remap_all=False, ids=None):
+        """Copies the cells of other (an MxGraph or a CellStore) into this graph.
+        The root cell of other is not copied; its children (usually layers)
+        are placed under parent, which defaults to this graph's root. Cells
+        whose identifier is already used in this graph get a new identifier,
+        or all cells do if remap_all is True. ids is an optional dictionary
+        with the identifiers to use for some cells of other; a ValueError is
+        raised if one of them is already used in this graph, or given twice.
+        other may be this graph itself. Parent, source and target
+        references are rewritten accordingly. Cells positioned on the page
+        (not inside another cell with a geometry) are moved by offset, an
+        (x,y) pair. All cells are added in one transaction.
+        Returns a dictionary that maps the identifiers in other to the
+        identifiers in this graph.
+        """
+        parent = self._get_parent(parent)
+        source_cells = other.cells.cells if isinstance(other, MxGraph) else other.cells
+        own = self.cells.cells
+
+        id_map = {}
+        to_remap = []
+        for cell_id, cell in source_cells.items():
+            if cell._parent_id is None:
+                id_map[cell_id] = parent.cell_id
+            elif ids is not None and cell_id in ids:
+                id_map[cell_id] = ids[cell_id]
+            elif remap_all or cell_id in own:
+                to_remap.append(cell_id)
+            else:
+                id_map[cell_id] = cell_id
+        if ids is not None:
+            wanted = [ id_map[c] for c in ids if c in id_map and source_cells[c]._parent_id is not None ]
+            taken = sorted(set(c for c in wanted if c in own))
+            if taken:
+                raise ValueError('identifiers already used in this graph: %s' % ', '.join(taken))
+            kept = [ c for c in id_map if source_cells[c]._parent_id is not None ]
+            if len(set(id_map[c] for c in kept)) != len(kept):
+                raise ValueError('ids gives several cells the same identifier')
+        id_map.update(zip(to_remap, self.cells.new_ids(len(to_remap), reserved=set(id_map.values()))))
+
+        # cells on the page are children of the root, or of a cell without
+        # geometry (such as a layer) that is on the page itself
+        on_page = {}
+        def is_on_page(cell_id):
+            path = []
+            c = cell_id
+            while c not in on_page:
+                cell = source_cells.get(c)
+                if cell is None or cell._parent_id is None or c in path:
+                    on_page[c] = True
+                    break
+                path.append(c)
+                c = cell._parent_id
+            for c in reversed(path):
+                p_id = source_cells[c]._parent_id
+                p = source_cells.get(p_id)
+                positioned = p is not None and p._parent_id is not None and p.geometry is not None and not p.geometry.relative
+                on_page[c] = on_page[p_id] and not positioned
+            return on_page[cell_id]
+
+        dx, dy = offset
+        with self.transaction():
+            # a list, since other may be this graph
+            for cell_id, cell in list(source_cells.items()):
+                if cell._parent_id is None:
+                    continue
+                new_id = id_map[cell_id]
+                copy = MxCell(self.cells, new_id, vertex=cell.vertex, edge=cell.edge)
+                copy.attrs = dict(cell.attrs)
+                copy._parent_id = id_map.get(cell._parent_id, cell._parent_id)
+                copy._source_id = id_map.get(cell._source_id, cell._source_id)
+                copy._target_id = id_map.get(cell._target_id, cell._target_id)
+                for key, value in (('id', new_id), ('parent', copy._parent_id), ('source', copy._source_id), ('target', copy._target_id)):
+                    if key in copy.attrs:
+                        copy.attrs[key] = value
+                # the copy is not in the store yet, so there is nothing to track
+                if cell.style is not None:
+                    copy._style = cell.style.copy()
+                    copy._style._add_owner(copy)
+                if cell.geometry is not None:
+                    if (dx or dy) and is_on_page(cell_id):
+                        copy._geometry = cell.geometry.copy(dx, dy)
+                    else:
+                        copy._geometry = cell.geometry.copy()
+                    copy._geometry._add_owner(copy)
+                self.cells.add_cell(copy)
+        return id_map
+
+    def snapshot(self):
+        """Returns a read-only CellStoreSnapshot of the cells of this graph, in
+        constant time. Other threads can read the snapshot while this graph is
+        being changed; see CellStore.snapshot, also for changes to waypoints
+        that the snapshot does not see."""
+        return self.cells.snapshot()
+
+    def validate(self):
+        """Checks the graph for dangling references and other problems. Returns
+        a ValidationResult; see CellStore.validate."""
+        return self.cells.validate()
+
+    def stats(self, sample=1000):
+        """Returns counts, estimated memory use and cache statistics of this
+        graph as a dict; see CellStore.stats. This is cheap enough to call
+        periodically on large graphs."""
+        return self.cells.stats(sample)
+
+    def create_index(self, field, name=None):
+        """Declares a secondary index on the cells of this graph. See
+        CellStore.create_index."""
+        return self.cells.create_index(field, name)
+
+    def query(self, query):
+        """Returns the cells that match the CellQuery query, for example
+        StyleQuery('shape', 'cylinder') & KindQuery('vertex')."""
+        return self.cells.query(query)
+
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, validate=False, parents=None):
+        """Reads a graph from the drawio file f. If validate is True, the graph
+        is checked while loading and a ValidationError is raised if it has
+        dangling references or other problems (see CellStore.validate).
+        If parents is given, a set of cell identifiers of layers or groups,
+        only the cells under them, the edges that touch them and the cells
+        that these refer to are loaded; see select_cells.
+        """
         g = MxGraph()
         et = dxml.parse(f)
         root = et.getroot()
@@ -430,13 +1756,15 @@ class MxGraph:
         g.cells.prefix = g.diagram_id
         t = urllib.parse.unquote(zlib.decompress(base64.b64decode(diagram.text), -zlib.MAX_WBITS).decode("utf-8"))
         graph_xml = dxml.fromstring(t)
-        g.mxgraph_model = MxGraphModel.from_xml(g.cells, graph_xml)
+        g.mxgraph_model = MxGraphModel.from_xml(g.cells, graph_xml, validate=validate, parents=parents)
         return g
 
-    def to_file(self, f):
+    def to_diagram_xml(self, name='Page-1'):
+        """Returns the diagram element for this graph, a page named name with
+        the compressed graph model."""
         diagram_xml = ET.Element('diagram')
         diagram_xml.set('id', self.diagram_id)
-        diagram_xml.set('name', 'Page-1')
+        diagram_xml.set('name', name)
         graph_xml = self.mxgraph_model.to_xml(self.cells)
         s = dxml.tostring(graph_xml)
         co = zlib.compressobj(wbits=-zlib.MAX_WBITS)
@@ -444,15 +1772,20 @@ class MxGraph:
         b += co.flush(zlib.Z_FINISH)
         s = base64.b64encode(b)
         diagram_xml.text = s.decode('utf-8')
-        mxfile_xml = ET.Element('mxfile')
-        mxfile_xml.set('host', 'py-mxgraph')
-        # mxfile_xml.set('modified', 'TODO')
-        # mxfile_xml.set('version', 'TODO')
-        # mxfile_xml.set('type', 'device')
-        mxfile_xml.append(diagram_xml)
-        # TODO: dump to file f, not stdout
-        # ET.dump(mxfile_xml)
-        f.write(dxml.tostring(mxfile_xml).decode('utf-8'))
-
-
+        return diagram_xml
 
+    def to_file(self, f):
+        write_diagrams(f, [ self.to_diagram_xml() ])
+
+
+def write_diagrams(f, diagrams):
+    """Writes a drawio file with the diagram elements in diagrams (see
+    MxGraph.to_diagram_xml) as its pages to the text file object f."""
+    mxfile_xml = ET.Element('mxfile')
+    mxfile_xml.set('host', 'py-mxgraph')
+    # mxfile_xml.set('modified', 'TODO')
+    # mxfile_xml.set('version', 'TODO')
+    # mxfile_xml.set('type', 'device')
+    for diagram_xml in diagrams:
+        mxfile_xml.append(diagram_xml)
+    f.write(dxml.tostring(mxfile_xml).decode('utf-8'))
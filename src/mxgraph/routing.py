@@ -0,0 +1,272 @@
+"""Orthogonal routing of edges around the vertices of a graph.
+
+The router puts all vertices that can be in the way in a SpatialGrid, and
+routes every edge with A* over a routing grid that is built for the box around
+its end points. The grid lines run along the sides of the obstacles in that
+box (kept at a clearance), through the centers of the connected vertices in it
+and halfway between neighbouring lines, so a route only has a grid point where
+it could bend. As the lines of all searches come from the same obstacles and
+centers, neighbouring routes share them: the router remembers (in a bounded
+cache) which grid segments cross obstacles, and which segments earlier routes
+already use so that later routes spread out. The cost of routing an edge
+depends on the number of obstacles and connected vertices in the box around
+its end points, not on the size of the page.
+"""
+
+import bisect
+import heapq
+from .mxgraph import MxGeometry, MxPoint, KindQuery
+from .spatial import SpatialGrid
+
+# directions: right, down, left, up
+_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+
+class OrthogonalRouter:
+    """Computes obstacle avoiding orthogonal routes for the edges of graph and
+    stores them as waypoints in the edges' MxGeometry.points.
+
+    clearance is the distance that routes keep from obstacles. bend_penalty
+    and crowding_penalty are the extra costs, in pixels, of a bend and of a
+    segment that an earlier route already uses. margin is how far, in pixels,
+    a route may wander outside the box around its end points. A search gives
+    up after expansions_per_line times the number of grid lines in that box.
+    The cache of obstacle crossings is emptied whenever it reaches
+    crossing_cache_size entries.
+    """
+
+    def __init__(self, graph, clearance=10, bend_penalty=40, crowding_penalty=20, margin=200, expansions_per_line=50, crossing_cache_size=100000):
+        self.graph = graph
+        self.clearance = clearance
+        self.bend_penalty = bend_penalty
+        self.crowding_penalty = crowding_penalty
+        self.margin = margin
+        self.expansions_per_line = expansions_per_line
+        self.crossing_cache_size = crossing_cache_size
+        self.bounds = {}
+        self.obstacles = SpatialGrid()
+        self.centers = SpatialGrid()
+        self.grid_lines = 0
+        self.crossing = {}
+        self.crossing_lookups = 0
+        self.crossing_misses = 0
+        self.used = set()
+        self._load_obstacles()
+
+    def _load_obstacles(self):
+        vertices = self.graph.query(KindQuery('vertex'))
+        # containers (vertices with child cells) do not block their contents
+        containers = set(c._parent_id for c in self.graph.cells.values())
+        c = self.clearance
+        for v in vertices:
+            b = self.graph.absolute_bounds(v)
+            if b is None:
+                continue
+            self.bounds[v.cell_id] = b
+            if v.cell_id in containers:
+                continue
+            x, y, w, h = b
+            self.obstacles.insert(v.cell_id, (x - c, y - c, w + 2 * c, h + 2 * c))
+
+    def _grid(self, box):
+        """Returns the sorted x and y grid lines inside box: the sides of the
+        obstacles that overlap box, the lines halfway between them and the
+        centers of the connected vertices in box."""
+        bx, by, bw, bh = box
+        rects = self.obstacles.rects
+        xs = set()
+        ys = set()
+        for k in self.obstacles.intersecting(box):
+            x, y, w, h = rects[k]
+            xs.update((x, x + w))
+            ys.update((y, y + h))
+        xs = self._with_midlines(xs)
+        ys = self._with_midlines(ys)
+        rects = self.centers.rects
+        for k in self.centers.intersecting(box):
+            x, y, w, h = rects[k]
+            xs.add(x)
+            ys.add(y)
+        return ([ x for x in sorted(xs) if bx <= x <= bx + bw ],
+                [ y for y in sorted(ys) if by <= y <= by + bh ])
+
+    def _with_midlines(self, lines):
+        lines = sorted(lines)
+        lines.extend([ (a + b) / 2 for a, b in zip(lines, lines[1:]) if b - a > 2 * self.clearance ])
+        return set(lines)
+
+    def _center(self, cell_id):
+        x, y, w, h = self.bounds[cell_id]
+        return (x + w / 2, y + h / 2)
+
+    def _crossing(self, x, y):
+        """Returns the obstacles that strictly contain (x, y), the midpoint of
+        a grid segment. As every obstacle side is a grid line, a segment is
+        either completely inside an obstacle or completely outside of it."""
+        occ = self.crossing.get((x, y))
+        if occ is None:
+            self.crossing_misses += 1
+            rects = self.obstacles.rects
+            occ = []
+            for k in self.obstacles.at_point(x, y):
+                rx, ry, rw, rh = rects[k]
+                if rx < x < rx + rw and ry < y < ry + rh:
+                    occ.append(k)
+            occ = tuple(occ)
+            if len(self.crossing) >= self.crossing_cache_size:
+                self.crossing.clear()
+            self.crossing[(x, y)] = occ
+        return occ
+
+    def _search(self, start, goal, ends, margin):
+        sx, sy = start
+        gx, gy = goal
+        xs, ys = self._grid((min(sx, gx) - margin, min(sy, gy) - margin, abs(sx - gx) + 2 * margin, abs(sy - gy) + 2 * margin))
+        self.grid_lines = max(self.grid_lines, len(xs) + len(ys))
+        lo_i, hi_i = 0, len(xs) - 1
+        lo_j, hi_j = 0, len(ys) - 1
+        start_node = (bisect.bisect_left(xs, sx), bisect.bisect_left(ys, sy))
+        goal_node = (bisect.bisect_left(xs, gx), bisect.bisect_left(ys, gy))
+        max_expansions = self.expansions_per_line * (hi_i - lo_i + hi_j - lo_j + 2)
+        bend_penalty = self.bend_penalty
+        crowding_penalty = self.crowding_penalty
+        used = self.used
+        crossing = self.crossing
+
+        def heuristic(i, j):
+            # distance plus one bend if the goal is not in line
+            x, y = xs[i], ys[j]
+            if x == gx or y == gy:
+                return abs(x - gx) + abs(y - gy)
+            return abs(x - gx) + abs(y - gy) + bend_penalty
+
+        start_state = start_node + (-1,)
+        cost = { start_state: 0 }
+        came_from = {}
+        # ties on f are broken by the smallest remaining distance
+        h = heuristic(*start_node)
+        heap = [ (h, h, 0, start_state) ]
+        expansions = 0
+        lookups = 0
+        path = None
+        while heap:
+            f, h, g, state = heapq.heappop(heap)
+            if g > cost[state]:
+                continue
+            i, j, d = state
+            if (i, j) == goal_node:
+                path = [ (xs[i], ys[j]) ]
+                while state in came_from:
+                    state = came_from[state]
+                    path.append((xs[state[0]], ys[state[1]]))
+                path.reverse()
+                break
+            expansions += 1
+            if expansions > max_expansions:
+                break
+            x, y = xs[i], ys[j]
+            for nd, (di, dj) in enumerate(_DIRECTIONS):
+                if d >= 0 and nd == (d + 2) % 4:
+                    continue
+                ni, nj = i + di, j + dj
+                if ni < lo_i or ni > hi_i or nj < lo_j or nj > hi_j:
+                    continue
+                nx, ny = xs[ni], ys[nj]
+                mid = ((x + nx) / 2, (y + ny) / 2)
+                lookups += 1
+                occ = crossing.get(mid)
+                if occ is None:
+                    occ = self._crossing(*mid)
+                if occ and any(k not in ends for k in occ):
+                    continue
+                ng = g + abs(nx - x) + abs(ny - y)
+                if mid in used:
+                    ng += crowding_penalty
+                if d >= 0 and nd != d:
+                    ng += bend_penalty
+                nstate = (ni, nj, nd)
+                if ng < cost.get(nstate, ng + 1):
+                    cost[nstate] = ng
+                    came_from[nstate] = state
+                    nh = heuristic(ni, nj)
+                    heapq.heappush(heap, (ng + nh, nh, ng, nstate))
+        self.crossing_lookups += lookups
+        return path
+
+    @staticmethod
+    def _bends(path):
+        """Returns the points of path where it changes direction."""
+        bends = []
+        for a, b, c in zip(path, path[1:], path[2:]):
+            if (a[0] == b[0]) != (b[0] == c[0]):
+                bends.append((int(round(b[0])), int(round(b[1]))))
+        return bends
+
+    def _add_center(self, cell_id):
+        cx, cy = self._center(cell_id)
+        self.centers.insert(cell_id, (cx, cy, 0, 0))
+
+    def route_edge(self, edge):
+        """Routes edge and sets its waypoints, relative to the edge's parent.
+        Returns False if no route around the obstacles was found, in which
+        case the edge gets a single bend."""
+        s, t = edge._source_id, edge._target_id
+        if s not in self.bounds or t not in self.bounds:
+            return False
+        self._add_center(s)
+        self._add_center(t)
+        sc = self._center(s)
+        tc = self._center(t)
+        ends = (s, t)
+        path = self._search(sc, tc, ends, self.margin)
+        if path is None:
+            path = self._search(sc, tc, ends, self.margin * 4)
+        if path is None:
+            points = [ (int(round(tc[0])), int(round(sc[1]))) ]
+            routed = False
+        else:
+            points = self._bends(path)
+            self.used.update(((a[0] + b[0]) / 2, (a[1] + b[1]) / 2) for a, b in zip(path, path[1:]))
+            routed = True
+        ox, oy = self.graph.origin(self.graph.cells.cells.get(edge._parent_id))
+        if edge.geometry is None:
+            edge.geometry = MxGeometry(relative=True)
+        edge.geometry.points = [ MxPoint(x - ox, y - oy) for x, y in points ]
+        return routed
+
+    def stats(self):
+        """Returns a dict with the size of the largest routing grid searched
+        so far, the sizes of the caches of this router and the hit rate of the
+        obstacle crossing cache."""
+        lookups = self.crossing_lookups
+        hits = lookups - self.crossing_misses
+        return {
+            'obstacles': len(self.obstacles),
+            'grid_lines': self.grid_lines,
+            'crossing_cache': len(self.crossing),
+            'crossing_lookups': lookups,
+            'crossing_hit_rate': hits / lookups if lookups else 0.0,
+            'used_segments': len(self.used),
+        }
+
+    def route(self, edges):
+        """Routes all edges in edges. Returns the edges for which no route
+        around the obstacles was found."""
+        edges = list(edges)
+        # add the grid lines of all end points before routing, so that every
+        # route sees the same lines
+        for e in edges:
+            for cell_id in (e._source_id, e._target_id):
+                if cell_id in self.bounds:
+                    self._add_center(cell_id)
+        return [ e for e in edges if not self.route_edge(e) ]
+
+
+def route_edges(graph, edges=None, **kwargs):
+    """Routes edges (by default, all edge cells of graph) orthogonally around
+    the vertices of graph. Keyword arguments are passed to OrthogonalRouter.
+    Returns the edges for which no route around the obstacles was found.
+    """
+    if edges is None:
+        edges = graph.query(KindQuery('edge'))
+    return OrthogonalRouter(graph, **kwargs).route(edges)
@@ -0,0 +1,340 @@
+"""Splitting a large graph into shards, smaller graphs that can be written as
+separate files or pages and processed independently.
+
+Cells are moved between shards in units: a unit is a vertex or edge on the
+page (a child of the root or of a layer) together with everything inside it.
+Structural cells (the root and the layers) are copied into every shard. A
+ShardPlan decides which shard every unit goes to, either by the tile of the
+page that the unit is in (tile_plan) or by the connected component of the
+unit (component_plan). An edge whose end points are in different shards is
+copied as a stub into the shards of both ends: in each copy, the end that is
+in another shard is replaced by a terminal point at the position of that
+end, and the attributes sourceShard and sourceCell (or targetShard and
+targetCell) name the shard and the identifier of the cell it points to.
+
+Shards are built and written in parallel by worker threads or, on request,
+by forked worker processes, which read the source graph from the memory that
+they inherit from the parent.
+"""
+
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .mxgraph import CellStore, MxGraph, MxPoint, write_diagrams
+
+
+def _is_structural(cell):
+    return not cell.vertex and not cell.edge and cell.geometry is None
+
+
+def _units(cells):
+    """Returns a dictionary that maps every cell identifier to the identifier
+    of its unit, or to None for structural cells."""
+    unit_of = {}
+    for cell_id in cells:
+        path = []
+        c = cell_id
+        while c not in unit_of:
+            cell = cells[c]
+            if _is_structural(cell):
+                unit_of[c] = None
+                break
+            p = cell._parent_id
+            parent = cells.get(p) if p is not None else None
+            if parent is None or _is_structural(parent) or p == c or p in path:
+                unit_of[c] = c
+                break
+            path.append(c)
+            c = p
+        for x in path:
+            unit_of[x] = unit_of[c]
+    return unit_of
+
+
+def _center(graph, cell):
+    """Returns the page position of cell: the center of a vertex, or the first
+    point of an edge."""
+    b = graph.absolute_bounds(cell)
+    if b is not None:
+        return (b[0] + b[2] / 2, b[1] + b[3] / 2)
+    g = cell.geometry
+    if g is not None:
+        ox, oy = graph.origin(graph.cells.cells.get(cell._parent_id))
+        for p in [ g.source_point ] + g.points + [ g.target_point ]:
+            if p is not None:
+                return (p.x + ox, p.y + oy)
+    return (0, 0)
+
+
+class ShardPlan:
+    """Decides which cells of graph go to which shard. unit_of maps cell
+    identifiers to units (see _units), shard_of maps units to shard keys and
+    names maps shard keys to shard names, in the order of the shards.
+
+    members[key] are the identifiers of the (non-structural) cells of shard
+    key, including stubs, and stubs[key] the identifiers of the edges that are
+    stubs in it. If remap is True, every shard gives its cells new
+    identifiers, made of the shard's diagram id and a number, and id_maps[key]
+    maps the identifiers in graph to those in shard key. Otherwise, cells
+    keep their identifiers.
+    """
+
+    def __init__(self, graph, unit_of, shard_of, names, remap=False):
+        cells = graph.cells.cells
+        self.graph = graph
+        self.unit_of = unit_of
+        self.names = names
+        self.owner = {}
+        self.structural = [ c for c, u in unit_of.items() if u is None ]
+        self.members = dict((key, []) for key in names)
+        self.stubs = dict((key, []) for key in names)
+        for cell_id, unit in unit_of.items():
+            if unit is not None:
+                key = shard_of[unit]
+                self.owner[cell_id] = key
+                self.members[key].append(cell_id)
+        for cell_id, key in self.owner.items():
+            cell = cells[cell_id]
+            if cell._source_id is None and cell._target_id is None:
+                continue
+            others = set(self.owner.get(e, key) for e in (cell._source_id, cell._target_id))
+            others.discard(key)
+            if others:
+                self.stubs[key].append(cell_id)
+                for other in others:
+                    self.members[other].append(cell_id)
+                    self.stubs[other].append(cell_id)
+        self.id_maps = {}
+        if remap:
+            taken = set(self.structural)
+            for key in names:
+                ids = {}
+                n = 0
+                for cell_id in self.members[key]:
+                    new_id = '%s-%d' % (self.diagram_id(key), n)
+                    while new_id in taken:
+                        n += 1
+                        new_id = '%s-%d' % (self.diagram_id(key), n)
+                    ids[cell_id] = new_id
+                    n += 1
+                self.id_maps[key] = ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def diagram_id(self, key):
+        """Returns the diagram id of shard key."""
+        return '%s-%s' % (self.graph.diagram_id, self.names[key])
+
+    def cell_id(self, key, cell_id):
+        """Returns the identifier that the cell with identifier cell_id in the
+        source graph has in shard key."""
+        ids = self.id_maps.get(key)
+        return cell_id if ids is None else ids.get(cell_id, cell_id)
+
+
+def tile_plan(graph, tile_size=2000, remap=False):
+    """Returns a ShardPlan that cuts the page of graph into square tiles of
+    tile_size pixels. A vertex goes to the tile that contains its center, an
+    edge to the tile of its source (or target). Shards are named
+    tile-<column>-<row>."""
+    cells = graph.cells.cells
+    unit_of = _units(cells)
+    units = [ c for c, u in unit_of.items() if u == c ]
+    shard_of = {}
+    edges = []
+    for unit in units:
+        cell = cells[unit]
+        if cell._source_id is not None or cell._target_id is not None:
+            edges.append(unit)
+            continue
+        x, y = _center(graph, cell)
+        shard_of[unit] = (int(x // tile_size), int(y // tile_size))
+    for unit in edges:
+        cell = cells[unit]
+        for end in (cell._source_id, cell._target_id):
+            key = shard_of.get(unit_of.get(end))
+            if key is not None:
+                shard_of[unit] = key
+                break
+        else:
+            x, y = _center(graph, cell)
+            shard_of[unit] = (int(x // tile_size), int(y // tile_size))
+    names = dict((key, 'tile-%d-%d' % key) for key in sorted(set(shard_of.values()), key=lambda k: (k[1], k[0])))
+    return ShardPlan(graph, unit_of, shard_of, names, remap)
+
+
+def component_plan(graph, max_cells=None, remap=False):
+    """Returns a ShardPlan with a shard for every set of units that are
+    connected by edges, largest first. If max_cells is given, small
+    components are put together in shards of at most max_cells cells (a
+    component that is larger than that gets a shard of its own). Shards are
+    named component-<number>."""
+    cells = graph.cells.cells
+    unit_of = _units(cells)
+    up = dict((c, c) for c, u in unit_of.items() if u == c)
+
+    def find(u):
+        root = u
+        while up[root] != root:
+            root = up[root]
+        while up[u] != root:
+            up[u], u = root, up[u]
+        return root
+
+    for cell_id, unit in unit_of.items():
+        if unit is None:
+            continue
+        cell = cells[cell_id]
+        for end in (cell._source_id, cell._target_id):
+            other = unit_of.get(end)
+            if other is not None:
+                a, b = find(unit), find(other)
+                if a != b:
+                    up[b] = a
+
+    components = {}
+    sizes = {}
+    order = {}
+    for cell_id, unit in unit_of.items():
+        if unit is None:
+            continue
+        root = find(unit)
+        if root not in components:
+            components[root] = []
+            sizes[root] = 0
+            order[root] = len(order)
+        if unit == cell_id:
+            components[root].append(unit)
+        sizes[root] += 1
+    roots = sorted(components, key=lambda r: (-sizes[r], order[r]))
+
+    shard_of = {}
+    if max_cells is None:
+        for key, root in enumerate(roots):
+            for unit in components[root]:
+                shard_of[unit] = key
+        count = len(roots)
+    else:
+        # put every component in the emptiest shard if it fits, and in a new
+        # shard otherwise
+        shards = []
+        count = 0
+        for root in roots:
+            if shards and shards[0][0] + sizes[root] <= max_cells:
+                size, key = heapq.heappop(shards)
+            else:
+                size, key = 0, count
+                count += 1
+            for unit in components[root]:
+                shard_of[unit] = key
+            heapq.heappush(shards, (size + sizes[root], key))
+    names = dict((key, 'component-%d' % key) for key in range(count))
+    return ShardPlan(graph, unit_of, shard_of, names, remap)
+
+
+def build_shard(plan, key):
+    """Returns a new MxGraph with the cells of shard key of plan."""
+    graph = plan.graph
+    cells = graph.cells.cells
+    shard = MxGraph(diagram_id=plan.diagram_id(key))
+    part = CellStore()
+    part.cells = dict((c, cells[c]) for c in plan.structural + plan.members[key])
+    id_map = shard.merge(part, ids=plan.id_maps.get(key))
+    # the shard is new, so nothing listens to or indexes these changes
+    for edge_id in plan.stubs[key]:
+        edge = cells[edge_id]
+        stub = shard.cells[id_map[edge_id]]
+        local = [ e for e in (edge._source_id, edge._target_id) if e is not None and plan.owner.get(e, key) == key ]
+        parent = edge._parent_id
+        if parent is not None and plan.owner.get(parent, key) != key:
+            # the parent of the edge is in another shard: move the stub to
+            # the structural cell that contains its local end
+            unit = cells[plan.unit_of[local[0]]]
+            old_origin = graph.origin(edge.parent)
+            stub._parent_id = id_map.get(unit._parent_id, shard.root.cell_id)
+            origin = (0, 0)
+            if stub.geometry is not None:
+                stub.geometry.points = [ p.copy(*old_origin) for p in stub.geometry.points ]
+        else:
+            origin = graph.origin(edge.parent)
+        for end, name in ((edge._source_id, 'source'), (edge._target_id, 'target')):
+            other = plan.owner.get(end, key)
+            if other == key:
+                continue
+            setattr(stub, '_%s_id' % name, None)
+            stub.attrs.pop(name, None)
+            stub.attrs['%sShard' % name] = plan.names[other]
+            stub.attrs['%sCell' % name] = plan.cell_id(other, end)
+            x, y = _center(graph, cells[end])
+            if stub.geometry is not None:
+                point = MxPoint(int(round(x - origin[0])), int(round(y - origin[1])))
+                setattr(stub.geometry, '%s_point' % name, point)
+    return shard
+
+
+def build_shards(plan):
+    """Returns a dictionary with the MxGraph of every shard of plan."""
+    return dict((key, build_shard(plan, key)) for key in plan.keys())
+
+
+# the plan that a worker process works on, set by _init_worker in the
+# worker; the parent process never sets it
+_plan = None
+
+
+def _init_worker(plan):
+    global _plan
+    _plan = plan
+
+
+def _write_shard(key, path, plan=None):
+    shard = build_shard(plan or _plan, key)
+    with open(path, 'w') as f:
+        shard.to_file(f)
+    return path
+
+
+def _shard_diagram(key, plan=None):
+    plan = plan or _plan
+    return build_shard(plan, key).to_diagram_xml(plan.names[key])
+
+
+def _run(plan, task, args, max_workers, processes):
+    """Runs task(key, *args[key]) for every shard key of plan, and returns
+    the results in the order of the shards. Uses forked processes if
+    processes is True and the platform supports it, and threads otherwise.
+    The plan is handed to every process by the pool's initializer, and as
+    the processes are forked it is inherited rather than pickled."""
+    keys = plan.keys()
+    if processes and 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker, initargs=(plan,)) as executor:
+            futures = [ executor.submit(task, key, *args[key]) for key in keys ]
+            return [ f.result() for f in futures ]
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = [ executor.submit(task, key, *args[key], plan=plan) for key in keys ]
+        return [ f.result() for f in futures ]
+
+
+def write_shards(plan, directory, max_workers=None, processes=False):
+    """Writes every shard of plan to the file <name>.drawio in directory, in
+    parallel. Shards are built by threads, or by forked processes if
+    processes is True (see _run); forking is only safe if no other threads
+    of the program hold locks at that time. Returns a dictionary with the
+    path of every shard."""
+    args = dict((key, (os.path.join(directory, '%s.drawio' % name),)) for key, name in plan.names.items())
+    paths = _run(plan, _write_shard, args, max_workers, processes)
+    return dict(zip(plan.keys(), paths))
+
+
+def write_pages(plan, f, max_workers=None, processes=False):
+    """Writes all shards of plan as the pages of one drawio file to the text
+    file object f. The pages are built in parallel, by threads or, if
+    processes is True, by forked processes (see write_shards)."""
+    args = dict((key, ()) for key in plan.keys())
+    write_diagrams(f, _run(plan, _shard_diagram, args, max_workers, processes))
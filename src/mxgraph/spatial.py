@@ -0,0 +1,154 @@
+"""Spatial index for rectangles, used to find cells near a point or inside an area."""
+
+import math
+
+
+def _segment_overlaps(rect, a, b):
+    """Returns True if the line segment from a to b overlaps rect, found by
+    clipping the segment to rect (Liang-Barsky)."""
+    x, y, w, h = rect
+    (ax, ay), (bx, by) = a, b
+    dx, dy = bx - ax, by - ay
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, ax - x), (dx, x + w - ax), (-dy, ay - y), (dy, y + h - ay)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+class SpatialGrid:
+    """Uniform bucket grid over rectangles and polylines. Every rectangle
+    (x, y, width, height) is stored under a key in all buckets of bucket_size x
+    bucket_size that it overlaps, and every polyline in the buckets along its
+    segments. Queries only look at the buckets that overlap the query area, so
+    their cost depends on the size of the area and not on the number of
+    rectangles in the index.
+
+    rects maps every key to its rectangle, or to the bounding box of its
+    polyline, and polylines maps the keys of polylines to their points.
+    """
+
+    def __init__(self, bucket_size=200):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        self.rects = {}
+        self.polylines = {}
+
+    def _range(self, lo, hi):
+        s = self.bucket_size
+        return range(math.floor(lo / s), math.floor(hi / s) + 1)
+
+    def _bucket_keys(self, key):
+        x, y, w, h = self.rects[key]
+        points = self.polylines.get(key)
+        if points is None or len(points) == 1:
+            return [ (i, j) for i in self._range(x, x + w) for j in self._range(y, y + h) ]
+        # cut every segment into pieces no longer than a bucket, so that the
+        # box of every piece covers at most 2 x 2 buckets
+        s = self.bucket_size
+        keys = set()
+        for (ax, ay), (bx, by) in zip(points, points[1:]):
+            n = max(1, math.ceil(max(abs(bx - ax), abs(by - ay)) / s))
+            px, py = ax, ay
+            for k in range(1, n + 1):
+                if k == n:
+                    qx, qy = bx, by
+                else:
+                    qx, qy = ax + (bx - ax) * k / n, ay + (by - ay) * k / n
+                for i in self._range(min(px, qx), max(px, qx)):
+                    for j in self._range(min(py, qy), max(py, qy)):
+                        keys.add((i, j))
+                px, py = qx, qy
+        return keys
+
+    def _on_polyline(self, key, rect):
+        points = self.polylines[key]
+        return len(points) == 1 or any(_segment_overlaps(rect, a, b) for a, b in zip(points, points[1:]))
+
+    def insert(self, key, rect):
+        """Adds the rectangle rect under key. A key can only have one rectangle
+        or polyline."""
+        if key in self.rects:
+            self.remove(key)
+        self.rects[key] = rect
+        self._add(key)
+
+    def insert_polyline(self, key, points):
+        """Adds the polyline through the (x, y) points under key. The polyline
+        is only stored in the buckets along its segments, so that a long
+        diagonal line does not fill all buckets of its bounding box."""
+        if key in self.rects:
+            self.remove(key)
+        points = list(points)
+        xs = [ p[0] for p in points ]
+        ys = [ p[1] for p in points ]
+        self.rects[key] = (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+        self.polylines[key] = points
+        self._add(key)
+
+    def _add(self, key):
+        buckets = self.buckets
+        for b in self._bucket_keys(key):
+            bucket = buckets.get(b)
+            if bucket is None:
+                buckets[b] = bucket = set()
+            bucket.add(key)
+
+    def remove(self, key):
+        for b in self._bucket_keys(key):
+            bucket = self.buckets[b]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[b]
+        del self.rects[key]
+        self.polylines.pop(key, None)
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def at_point(self, x, y):
+        """Returns the keys of the rectangles and polylines that contain the
+        point (x, y)."""
+        s = self.bucket_size
+        bucket = self.buckets.get((math.floor(x / s), math.floor(y / s)), ())
+        rects = self.rects
+        polylines = self.polylines
+        result = []
+        for key in bucket:
+            rx, ry, rw, rh = rects[key]
+            if rx <= x <= rx + rw and ry <= y <= ry + rh:
+                if key not in polylines or self._on_polyline(key, (x, y, 0, 0)):
+                    result.append(key)
+        return result
+
+    def intersecting(self, rect):
+        """Returns the set of keys of the rectangles and polylines that overlap
+        rect."""
+        x, y, w, h = rect
+        rects = self.rects
+        polylines = self.polylines
+        seen = set()
+        result = set()
+        for i in self._range(x, x + w):
+            for j in self._range(y, y + h):
+                for key in self.buckets.get((i, j), ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    rx, ry, rw, rh = rects[key]
+                    if rx <= x + w and x <= rx + rw and ry <= y + h and y <= ry + rh:
+                        if key not in polylines or self._on_polyline(key, rect):
+                            result.add(key)
+        return result
@@ -0,0 +1,277 @@
+"""SVG export of graphs, for thumbnails and previews without a browser.
+
+The exporter draws vertices as basic shapes (rectangles, rounded rectangles,
+ellipses, rhombuses and cylinders) with their fill and stroke colours and
+text values, and edges as polylines through their waypoints. It keeps the
+page bounds of all vertices and the polylines of all edges in a SpatialGrid,
+so that rendering a viewport only looks at the cells near that viewport. The SVG is written piece by piece to
+a file object.
+"""
+
+import html
+import re
+from xml.sax.saxutils import escape, quoteattr
+from .mxgraph import cell_kind
+from .spatial import SpatialGrid
+
+_TAG = re.compile(r'<[^>]*>')
+
+
+def _text(value):
+    """Returns the plain text of a cell value, which may contain HTML."""
+    return html.unescape(_TAG.sub(' ', value)).strip()
+
+
+def _clip(rect, inside, outside):
+    """Returns the point where the line from inside (the center of rect)
+    towards outside leaves rect."""
+    x, y, w, h = rect
+    cx, cy = inside
+    dx, dy = outside[0] - cx, outside[1] - cy
+    if dx == 0 and dy == 0:
+        return inside
+    tx = (w / 2) / abs(dx) if dx else float('inf')
+    ty = (h / 2) / abs(dy) if dy else float('inf')
+    t = min(tx, ty, 1)
+    return (cx + dx * t, cy + dy * t)
+
+
+def _num(v):
+    return ('%.2f' % v).rstrip('0').rstrip('.')
+
+
+class SvgExporter:
+    """Renders graph as SVG. The exporter indexes the bounds of all cells when
+    it is created, and keeps the index up to date by listening to changes of
+    the graph until close() is called. Create one exporter per graph and use
+    it for many renderings.
+    """
+
+    def __init__(self, graph, bucket_size=500):
+        self.graph = graph
+        self.index = SpatialGrid(bucket_size=bucket_size)
+        self.order = {}
+        self._next_order = 0
+        self._build()
+        graph.add_listener(self._changed)
+
+    def close(self):
+        """Stops following the changes of the graph."""
+        self.graph.remove_listener(self._changed)
+
+    def _build(self):
+        # links[cell_id] is (parent, source, target); dependents[cell_id] are
+        # the children and connected edges, whose bounds depend on the cell
+        self.links = {}
+        self.dependents = {}
+        for cell in self.graph.cells.values():
+            self._link(cell)
+        for cell in self.graph.cells.values():
+            self._index(cell)
+
+    def _link(self, cell):
+        if cell.cell_id not in self.order:
+            self.order[cell.cell_id] = self._next_order
+            self._next_order += 1
+        links = (cell._parent_id, cell._source_id, cell._target_id)
+        self.links[cell.cell_id] = links
+        for other in links:
+            if other is not None:
+                self.dependents.setdefault(other, set()).add(cell.cell_id)
+
+    def _unlink(self, cell_id):
+        for other in self.links.pop(cell_id, ()):
+            deps = self.dependents.get(other)
+            if deps is not None:
+                deps.discard(cell_id)
+
+    def _index(self, cell):
+        # edges are indexed by their segments, so that a long edge is only in
+        # the buckets along its polyline
+        if cell.cell_id in self.index:
+            self.index.remove(cell.cell_id)
+        if cell.attrs.get('visible') == '0':
+            return
+        kind = cell_kind(cell)
+        if kind == 'vertex':
+            bounds = self.graph.absolute_bounds(cell)
+            if bounds is not None:
+                self.index.insert(cell.cell_id, bounds)
+        elif kind == 'edge':
+            points = self._edge_points(cell)
+            if points is not None:
+                self.index.insert_polyline(cell.cell_id, points)
+
+    def _changed(self, change_set):
+        cells = self.graph.cells
+        stale = set()
+        for cell_id in change_set.removed:
+            self._unlink(cell_id)
+            self.order.pop(cell_id, None)
+            if cell_id in self.index:
+                self.index.remove(cell_id)
+        for cell_id in change_set.added:
+            if cell_id in cells:
+                self._link(cells[cell_id])
+                stale.add(cell_id)
+        for cell_id, kinds in change_set.changed.items():
+            if 'link' in kinds:
+                self._unlink(cell_id)
+                self._link(cells[cell_id])
+            stale.add(cell_id)
+        # children and connected edges move with their cell
+        pending = list(stale)
+        while pending:
+            for dep in self.dependents.get(pending.pop(), ()):
+                if dep not in stale:
+                    stale.add(dep)
+                    pending.append(dep)
+        for cell_id in stale:
+            if cell_id in cells:
+                self._index(cells[cell_id])
+
+    def _edge_points(self, edge):
+        """Returns the page coordinates of the polyline of edge, or None."""
+        g = edge.geometry
+        ox, oy = self.graph.origin(self.graph.cells.cells.get(edge._parent_id))
+        points = [] if g is None else [ (p.x + ox, p.y + oy) for p in g.points ]
+        source = self.graph.cells.get(edge._source_id) if edge._source_id is not None else None
+        target = self.graph.cells.get(edge._target_id) if edge._target_id is not None else None
+        sb = self.graph.absolute_bounds(source) if source is not None else None
+        tb = self.graph.absolute_bounds(target) if target is not None else None
+        if sb is not None:
+            start = (sb[0] + sb[2] / 2, sb[1] + sb[3] / 2)
+        elif g is not None and g.source_point is not None:
+            start = (g.source_point.x + ox, g.source_point.y + oy)
+        else:
+            return None
+        if tb is not None:
+            end = (tb[0] + tb[2] / 2, tb[1] + tb[3] / 2)
+        elif g is not None and g.target_point is not None:
+            end = (g.target_point.x + ox, g.target_point.y + oy)
+        else:
+            return None
+        if sb is not None:
+            start = _clip(sb, start, points[0] if points else end)
+        if tb is not None:
+            end = _clip(tb, end, points[-1] if points else start)
+        return [ start ] + points + [ end ]
+
+    def visible_cells(self, viewport=None):
+        """Returns the cells whose bounds overlap viewport (x, y, width, height),
+        or all drawable cells, in drawing order."""
+        if viewport is None:
+            ids = list(self.index.rects)
+        else:
+            ids = list(self.index.intersecting(viewport))
+        ids.sort(key=self.order.__getitem__)
+        cells = self.graph.cells
+        return [ cells[i] for i in ids ]
+
+    def page_bounds(self):
+        """Returns the bounds of all drawable cells."""
+        rects = list(self.index.rects.values())
+        if not rects:
+            return (0, 0, 0, 0)
+        x0 = min(r[0] for r in rects)
+        y0 = min(r[1] for r in rects)
+        x1 = max(r[0] + r[2] for r in rects)
+        y1 = max(r[1] + r[3] for r in rects)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def write(self, f, viewport=None, margin=10):
+        """Writes the SVG to the text file object f. If viewport (x, y, width,
+        height) is given, only that part of the page is rendered, and only
+        the cells that overlap it are drawn. Otherwise the whole page is
+        rendered with margin around it.
+        """
+        cells = self.visible_cells(viewport)
+        if viewport is None:
+            x, y, w, h = self.page_bounds()
+            viewport = (x - margin, y - margin, w + 2 * margin, h + 2 * margin)
+        x, y, w, h = viewport
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" viewBox="%s %s %s %s">\n'
+                % (_num(w), _num(h), _num(x), _num(y), _num(w), _num(h)))
+        f.write('<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="8" markerHeight="8" '
+                'orient="auto-start-reverse"><path d="M0,0L10,5L0,10z" fill="context-stroke"/></marker></defs>\n')
+        for cell in cells:
+            if cell.vertex:
+                self._write_vertex(f, cell)
+            elif cell.edge:
+                self._write_edge(f, cell)
+        f.write('</svg>\n')
+
+    @staticmethod
+    def _style(cell):
+        return cell.style if cell.style is not None else {}
+
+    def _write_vertex(self, f, cell):
+        style = self._style(cell)
+        if 'group' in style:
+            return
+        x, y, w, h = self.graph.absolute_bounds(cell)
+        fill = style.get('fillColor') or '#ffffff'
+        stroke = style.get('strokeColor') or '#000000'
+        paint = 'fill=%s stroke=%s stroke-width=%s' % (quoteattr(fill), quoteattr(stroke), quoteattr(str(style.get('strokeWidth') or 1)))
+        shape = style.get('shape')
+        if 'text' in style or shape == 'text':
+            pass
+        elif 'ellipse' in style or shape == 'ellipse':
+            f.write('<ellipse cx="%s" cy="%s" rx="%s" ry="%s" %s/>\n' % (_num(x + w / 2), _num(y + h / 2), _num(w / 2), _num(h / 2), paint))
+        elif 'rhombus' in style or shape == 'rhombus':
+            pts = [ (x + w / 2, y), (x + w, y + h / 2), (x + w / 2, y + h), (x, y + h / 2) ]
+            f.write('<polygon points="%s" %s/>\n' % (' '.join('%s,%s' % (_num(px), _num(py)) for px, py in pts), paint))
+        elif shape == 'cylinder':
+            ry = min(h / 6, 15)
+            f.write('<path d="M%s,%sa%s,%s 0 0 0 %s,0v%sa%s,%s 0 0 1 -%s,0z" %s/>\n'
+                    % (_num(x), _num(y + ry), _num(w / 2), _num(ry), _num(w), _num(h - 2 * ry), _num(w / 2), _num(ry), _num(w), paint))
+            f.write('<path d="M%s,%sa%s,%s 0 0 0 %s,0a%s,%s 0 0 0 -%s,0" fill="none" stroke=%s/>\n'
+                    % (_num(x), _num(y + ry), _num(w / 2), _num(ry), _num(w), _num(w / 2), _num(ry), _num(w), quoteattr(stroke)))
+        else:
+            rounded = ' rx="%s"' % _num(min(w, h) * 0.15) if str(style.get('rounded')) == '1' else ''
+            f.write('<rect x="%s" y="%s" width="%s" height="%s"%s %s/>\n' % (_num(x), _num(y), _num(w), _num(h), rounded, paint))
+        self._write_text(f, cell, x + w / 2, y + h / 2)
+
+    def _write_text(self, f, cell, cx, cy):
+        value = cell.attrs.get('value')
+        if not value:
+            return
+        text = _text(value)
+        if not text:
+            return
+        style = self._style(cell)
+        f.write('<text x="%s" y="%s" text-anchor="middle" dominant-baseline="middle" font-family="Helvetica" font-size=%s fill=%s>%s</text>\n'
+                % (_num(cx), _num(cy), quoteattr(str(style.get('fontSize') or 12)), quoteattr(style.get('fontColor') or '#000000'), escape(text)))
+
+    def _write_edge(self, f, cell):
+        points = self._edge_points(cell)
+        if points is None:
+            return
+        style = self._style(cell)
+        stroke = style.get('strokeColor') or '#000000'
+        attrs = 'fill="none" stroke=%s stroke-width=%s' % (quoteattr(stroke), quoteattr(str(style.get('strokeWidth') or 1)))
+        if str(style.get('dashed')) == '1':
+            attrs += ' stroke-dasharray="3 3"'
+        if style.get('endArrow', 'classic') != 'none':
+            attrs += ' marker-end="url(#arrow)"'
+        if style.get('startArrow', 'none') != 'none':
+            attrs += ' marker-start="url(#arrow)"'
+        f.write('<polyline points="%s" %s/>\n' % (' '.join('%s,%s' % (_num(px), _num(py)) for px, py in points), attrs))
+        if len(points) % 2 == 0:
+            a, b = points[len(points) // 2 - 1], points[len(points) // 2]
+            mid = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+        else:
+            mid = points[len(points) // 2]
+        self._write_text(f, cell, *mid)
+
+
+def write_svg(graph, f, viewport=None, margin=10):
+    """Writes graph as SVG to the text file object f; see SvgExporter.write.
+    To render several viewports of the same graph, create an SvgExporter once
+    and call its write method instead."""
+    exporter = SvgExporter(graph)
+    try:
+        exporter.write(f, viewport, margin)
+    finally:
+        exporter.close()
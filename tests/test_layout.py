@@ -0,0 +1,108 @@
+import pytest
+from mxgraph.mxgraph import *
+from mxgraph.layout import *
+
+@pytest.fixture
+def make_graph():
+    def make(n, edges):
+        g = MxGraph()
+        layer = g.create_group_cell(cell_id='1')
+        vs = [ g.insert_vertex(parent=layer, cell_id='v%02d' % i, width=40, height=20) for i in range(n) ]
+        for s, t in edges:
+            g.insert_edge(parent=layer, source=vs[s], target=vs[t])
+        return g, layer, vs
+    return make
+
+def overlaps(a, b):
+    a, b = a.geometry, b.geometry
+    return a.x < b.x + b.width and b.x < a.x + a.width and a.y < b.y + b.height and b.y < a.y + a.height
+
+def assert_no_overlap(vs):
+    for i, a in enumerate(vs):
+        for b in vs[i+1:]:
+            assert not overlaps(a, b)
+
+def test_grid_layout(make_graph):
+    g, layer, vs = make_graph(5, [])
+    placed = grid_layout(g, parent=layer, columns=2, spacing=10)
+    assert len(placed) == 5
+    assert (vs[0].geometry.x, vs[0].geometry.y) == (0, 0)
+    assert (vs[1].geometry.x, vs[1].geometry.y) == (50, 0)
+    assert (vs[2].geometry.x, vs[2].geometry.y) == (0, 30)
+    assert_no_overlap(vs)
+
+def test_grid_layout_fills_missing_size():
+    g = MxGraph()
+    v = g.insert_vertex()
+    grid_layout(g)
+    assert (v.geometry.x, v.geometry.y, v.geometry.width, v.geometry.height) == (0, 0, 120, 60)
+
+def test_layered_layout_edges_point_down(make_graph):
+    edges = [ (0,1), (0,2), (1,3), (2,3), (3,4), (4,1) ]
+    g, layer, vs = make_graph(5, edges)
+    layered_layout(g, parent=layer)
+    assert_no_overlap(vs)
+    assert vs[0].geometry.y < vs[1].geometry.y
+    assert vs[0].geometry.y < vs[2].geometry.y
+    assert vs[1].geometry.y < vs[3].geometry.y
+
+def test_layered_layout_reduces_crossings(make_graph):
+    # two chains whose second layer starts out in crossing order
+    edges = [ (0,3), (1,2) ]
+    g, layer, vs = make_graph(4, edges)
+    layered_layout(g, parent=layer)
+    assert (vs[0].geometry.x < vs[1].geometry.x) == (vs[3].geometry.x < vs[2].geometry.x)
+
+def test_layered_layout_long_edges(make_graph):
+    # the long edge 4 -> 5 spans the layers of 7 and 8 and takes part in the
+    # ordering of the layer of 5 without leaving gaps in those layers
+    edges = [ (0,1), (1,2), (2,3), (4,7), (7,8), (8,5), (4,5) ]
+    g, layer, vs = make_graph(9, edges)
+    layered_layout(g, parent=layer)
+    assert_no_overlap(vs)
+    assert vs[4].geometry.y < vs[7].geometry.y < vs[8].geometry.y < vs[5].geometry.y
+    assert (vs[0].geometry.x < vs[4].geometry.x) == (vs[3].geometry.x < vs[5].geometry.x)
+    assert abs(vs[1].geometry.x - vs[7].geometry.x) == 40 + 30
+
+def test_layered_layout_horizontal(make_graph):
+    g, layer, vs = make_graph(2, [ (0,1) ])
+    layered_layout(g, parent=layer, horizontal=True)
+    assert vs[0].geometry.x < vs[1].geometry.x
+    assert vs[0].geometry.y == vs[1].geometry.y
+
+def test_tree_layout(make_graph):
+    edges = [ (0,1), (0,2), (1,3), (1,4), (2,5) ]
+    g, layer, vs = make_graph(6, edges)
+    tree_layout(g, parent=layer)
+    assert_no_overlap(vs)
+    assert vs[0].geometry.y < vs[1].geometry.y < vs[3].geometry.y
+    assert vs[1].geometry.y == vs[2].geometry.y
+    assert vs[3].geometry.x < vs[4].geometry.x < vs[5].geometry.x
+    # parent centered above its children
+    assert vs[1].geometry.x == (vs[3].geometry.x + vs[4].geometry.x) // 2
+
+def test_tree_layout_wide_parents(make_graph):
+    g, layer, vs = make_graph(4, [ (0,2), (1,3) ])
+    vs[0].geometry.width = 400
+    vs[1].geometry.width = 400
+    vs[2].geometry.width = 20
+    vs[3].geometry.width = 20
+    tree_layout(g, parent=layer)
+    assert_no_overlap(vs)
+    assert min(v.geometry.x for v in vs) >= 0
+    assert vs[0].geometry.x + 400 <= vs[1].geometry.x
+    # children centered below their wide parents
+    assert vs[2].geometry.x == vs[0].geometry.x + 190
+    assert vs[3].geometry.x == vs[1].geometry.x + 190
+
+def test_tree_layout_with_cycle(make_graph):
+    g, layer, vs = make_graph(3, [ (0,1), (1,2), (2,0) ])
+    tree_layout(g, parent=layer)
+    assert_no_overlap(vs)
+    assert vs[0].geometry.y < vs[1].geometry.y < vs[2].geometry.y
+
+def test_layout_only_children_of_parent(make_graph):
+    g, layer, vs = make_graph(2, [])
+    other = g.insert_vertex(x=500, y=500, width=10, height=10)
+    grid_layout(g, parent=layer)
+    assert (other.geometry.x, other.geometry.y) == (500, 500)
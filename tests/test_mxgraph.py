@@ -1,4 +1,5 @@
 
+import gc
 import pytest
 import sys
 import defusedxml.ElementTree as dxml
@@ -83,6 +84,58 @@ def test_read_edge_geometry_with_source_and_target_points(cell_store):
     assert geom.target_point.x == 450
     assert geom.target_point.y == 400
 
+def test_parse_number():
+    assert parse_number(None) is None
+    assert parse_number('120') == 120 and isinstance(parse_number('120'), int)
+    assert parse_number('-120.0') == -120 and isinstance(parse_number('-120.0'), int)
+    assert parse_number('120.5') == 120.5
+    assert parse_number('1e3') == 1000 and isinstance(parse_number('1e3'), int)
+    with pytest.raises(ValueError):
+        parse_number('abc')
+
+def test_read_fractional_geometry(cell_store):
+    s = """
+    <mxGeometry x="120.5" y="30.0" width="80.25" height="40" as="geometry">
+        <mxPoint y="450.5" as="sourcePoint"/>
+        <Array as="points">
+          <mxPoint x="250.75" y="250"/>
+          <mxPoint x="260" y="250.0"/>
+        </Array>
+      </mxGeometry>"""
+    geom = MxGeometry.from_xml(cell_store, dxml.fromstring(s))
+    assert (geom.x, geom.y, geom.width, geom.height) == (120.5, 30, 80.25, 40)
+    assert isinstance(geom.y, int)
+    assert [ (p.x, p.y) for p in geom.points ] == [ (250.75, 250), (260, 250) ]
+    assert (geom.source_point.x, geom.source_point.y) == (0, 450.5)
+    x = geom.to_xml()
+    assert x.get('x') == '120.5'
+    assert x.get('y') == '30'
+    assert x.findall('Array/mxPoint')[0].get('x') == '250.75'
+
+def test_number_table():
+    numbers = NumberTable()
+    assert numbers['10.5'] == 10.5
+    assert numbers['10'] == 10
+    assert numbers['20.0'] == 20 and isinstance(numbers['20.0'], int)
+    assert numbers[None] is None
+    assert numbers == { None: None, '10.5': 10.5, '10': 10, '20.0': 20 }
+
+def test_read_fractional_mxgraph_model(cell_store):
+    import io
+    s = """<mxGraphModel><root>
+      <mxCell id="0"/>
+      <mxCell id="1" parent="0"/>
+      <mxCell id="2" parent="1" vertex="1"><mxGeometry x="10.5" y="10" width="20" height="20" as="geometry"/></mxCell>
+      <mxCell id="3" parent="1" edge="1" source="2" target="2"><mxGeometry relative="1" as="geometry"><Array as="points"><mxPoint x="10.5" y="7.25"/></Array></mxGeometry></mxCell>
+    </root></mxGraphModel>"""
+    MxGraphModel.from_xml(cell_store, dxml.fromstring(s))
+    assert cell_store['2'].geometry.x == 10.5
+    assert cell_store['3'].geometry.points[0].y == 7.25
+    streamed = CellStore()
+    MxGraphModel.from_stream(streamed, io.BytesIO(s.encode()))
+    assert streamed['2'].geometry.x == 10.5
+    assert streamed['3'].geometry.points[0].y == 7.25
+
 def test_create_edge_geometry():
     geom = MxGeometry(relative=True)
     geom.points = [ MxPoint(x,y) for x,y in [ (10,20), (30,40) ] ]
@@ -435,6 +488,536 @@ def test_mxgraph_insert_edge():
     assert edge.geometry.target_point.x == 70
     assert edge.geometry.target_point.y == 80
 
+def test_origin_and_absolute_bounds():
+    g = MxGraph()
+    layer = g.create_group_cell(cell_id='1')
+    group = g.insert_vertex(parent=layer, x=100, y=50, width=500, height=300)
+    inner = g.create_group_cell(cell_id='inner', parent=group)
+    v = g.insert_vertex(parent=inner, x=10, y=20, width=40, height=40)
+    assert g.origin(None) == (0, 0)
+    assert g.origin(layer) == (0, 0)
+    assert g.origin(group) == (100, 50)
+    assert g.origin(inner) == (100, 50)
+    assert g.origin(v) == (110, 70)
+    assert g.absolute_bounds(v) == (110, 70, 40, 40)
+
+@pytest.fixture
+def query_graph():
+    g = MxGraph()
+    layer = g.create_group_cell(cell_id='1')
+    db = g.insert_vertex(parent=layer, style={'shape': 'cylinder', 'html': '1'})
+    db['value'] = 'database'
+    box = g.insert_vertex(parent=layer, style={'rounded': '0'})
+    box['value'] = 'server'
+    edge = g.insert_edge(parent=layer, source=box, target=db, style={'html': '1'})
+    return g, layer, db, box, edge
+
+def ids(cells):
+    return set(c.cell_id for c in cells)
+
+def test_query_without_index(query_graph):
+    g, layer, db, box, edge = query_graph
+    assert ids(g.query(StyleQuery('shape', 'cylinder'))) == { db.cell_id }
+    assert ids(g.query(KindQuery('vertex'))) == { db.cell_id, box.cell_id }
+    assert ids(g.query(StyleQuery('html') & ~KindQuery('edge'))) == { db.cell_id }
+    assert ids(g.query(AttrQuery('value', 'server') | KindQuery('edge'))) == { box.cell_id, edge.cell_id }
+    assert ids(g.query(ParentQuery(None))) == { g.root.cell_id }
+    assert ids(g.query(ParentQuery(layer))) == { db.cell_id, box.cell_id, edge.cell_id }
+
+def test_query_uses_index(query_graph):
+    g, layer, db, box, edge = query_graph
+    index = g.create_index('style', 'shape')
+    g.create_index('kind')
+    assert index.lookup('cylinder') == { db.cell_id }
+    q = StyleQuery('shape', 'cylinder') & KindQuery('vertex')
+    assert q.candidates(g.cells) == { db.cell_id }
+    assert ids(g.query(q)) == { db.cell_id }
+    assert ids(g.query(StyleQuery('shape'))) == { db.cell_id }
+
+def test_index_follows_mutations(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.create_index('style', 'shape')
+    g.create_index('attr', 'value')
+    g.create_index('parent')
+    box.style['shape'] = 'cylinder'
+    assert ids(g.query(StyleQuery('shape', 'cylinder'))) == { db.cell_id, box.cell_id }
+    db.style = MxStyle(ellipse=None)
+    assert ids(g.query(StyleQuery('shape', 'cylinder'))) == { box.cell_id }
+    db['value'] = 'renamed'
+    assert ids(g.query(AttrQuery('value', 'database'))) == set()
+    assert ids(g.query(AttrQuery('value', 'renamed'))) == { db.cell_id }
+    box.parent = g.root
+    assert ids(g.query(ParentQuery(layer))) == { db.cell_id, edge.cell_id }
+    del g.cells[db.cell_id]
+    assert ids(g.query(AttrQuery('value'))) == { box.cell_id }
+    v = g.insert_vertex(parent=layer, style={'shape': 'cylinder'})
+    assert ids(g.query(StyleQuery('shape', 'cylinder'))) == { box.cell_id, v.cell_id }
+
+def test_shared_style_owners(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.create_index('style', 'shape')
+    shared = MxStyle(shape='cloud')
+    vs = [ g.insert_vertex(parent=layer) for i in range(3) ]
+    for v in vs:
+        v.style = shared
+    shared['shape'] = 'hexagon'
+    assert ids(g.query(StyleQuery('shape', 'hexagon'))) == ids(vs)
+    vs[0].style = MxStyle()
+    vs[1].style = None
+    shared['shape'] = 'star'
+    assert ids(g.query(StyleQuery('shape', 'star'))) == { vs[2].cell_id }
+    assert ids(g.query(StyleQuery('shape', 'hexagon'))) == set()
+
+def test_change_events_without_transaction(query_graph):
+    g, layer, db, box, edge = query_graph
+    changes = []
+    g.add_listener(changes.append)
+    v = g.insert_vertex(parent=layer)
+    assert changes[-1].added == { v.cell_id }
+    box['value'] = 'renamed'
+    assert changes[-1].changed == { box.cell_id: { 'attr' } }
+    db.style['fillColor'] = '#ff0000'
+    assert changes[-1].changed == { db.cell_id: { 'attr' } }
+    box.geometry.x = 40
+    assert changes[-1].changed == { box.cell_id: { 'geometry' } }
+    edge.target = v
+    assert changes[-1].changed == { edge.cell_id: { 'link' } }
+    del g.cells[v.cell_id]
+    assert changes[-1].removed == { v.cell_id }
+    n = len(changes)
+    g.remove_listener(changes.append)
+    box['value'] = 'again'
+    assert len(changes) == n
+
+def test_transaction_coalesces_changes(query_graph):
+    g, layer, db, box, edge = query_graph
+    changes = []
+    g.add_listener(changes.append)
+    with g.transaction():
+        v = g.insert_vertex(parent=layer)
+        v['value'] = 'new'
+        tmp = g.insert_vertex(parent=layer)
+        del g.cells[tmp.cell_id]
+        box['value'] = 'renamed'
+        box.geometry = MxGeometry(x=1, y=2, width=3, height=4)
+        g.add_edge_geometry(edge, [(10, 20)])
+        with g.transaction():
+            edge.parent = g.root
+        del g.cells[db.cell_id]
+        assert changes == []
+    assert len(changes) == 1
+    cs = changes[0]
+    assert cs.added == { v.cell_id }
+    assert cs.removed == { db.cell_id }
+    assert cs.changed == { box.cell_id: { 'attr', 'geometry' }, edge.cell_id: { 'geometry', 'link' } }
+
+def test_transaction_rolls_back_on_exception(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.create_index('style', 'shape')
+    changes = []
+    g.add_listener(changes.append)
+    old_geometry = box.geometry
+    n = len(g.cells)
+    with pytest.raises(ValueError):
+        with g.transaction():
+            v = g.insert_vertex(parent=layer, style={'shape': 'cylinder'})
+            box['value'] = 'renamed'
+            del box['value']
+            db.style['shape'] = 'cloud'
+            old_geometry.x = 99
+            box.geometry = MxGeometry(x=1)
+            edge.source = db
+            edge.vertex = True
+            del g.cells[db.cell_id]
+            raise ValueError()
+    assert changes == []
+    assert len(g.cells) == n
+    assert v.cell_id not in g.cells
+    assert g.cells[db.cell_id] is db
+    assert box['value'] == 'server'
+    assert box.geometry is old_geometry
+    assert old_geometry.x is None
+    assert edge.source is box
+    assert not edge.vertex
+    assert ids(g.query(StyleQuery('shape', 'cylinder'))) == { db.cell_id }
+
+def test_rollback_restores_style_and_geometry_owners(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.create_index('style', 'shape')
+    old_style, old_geometry = db.style, db.geometry
+    with pytest.raises(ValueError):
+        with g.transaction():
+            db.style = MxStyle(shape='cloud')
+            db.geometry = MxGeometry(x=1)
+            raise ValueError()
+    assert db.style is old_style
+    assert db.geometry is old_geometry
+    changes = []
+    g.add_listener(changes.append)
+    db.style['shape'] = 'z'
+    assert ids(g.query(StyleQuery('shape', 'z'))) == { db.cell_id }
+    old_geometry.x = 5
+    assert changes[-1].changed == { db.cell_id: { 'geometry' } }
+
+def test_nested_transaction_rollback(query_graph):
+    g, layer, db, box, edge = query_graph
+    changes = []
+    g.add_listener(changes.append)
+    with g.transaction():
+        box['value'] = 'outer'
+        try:
+            with g.transaction():
+                db['value'] = 'inner'
+                box.geometry.x = 99
+                raise KeyError()
+        except KeyError:
+            pass
+    assert box['value'] == 'outer'
+    assert db['value'] == 'database'
+    assert len(changes) == 1
+    assert changes[0].changed == { box.cell_id: { 'attr' } }
+    assert db.cell_id not in changes[0].changed
+
+@pytest.fixture
+def make_merge_source():
+    def make(diagram_id='DIAGRAMID'):
+        g = MxGraph(diagram_id=diagram_id)
+        layer = g.create_group_cell(cell_id='1')
+        group = g.insert_vertex(parent=layer, x=100, y=100, width=200, height=200)
+        a = g.insert_vertex(parent=layer, x=10, y=20, width=40, height=40, style={'shape': 'cylinder'})
+        b = g.insert_vertex(parent=group, x=5, y=5, width=40, height=40)
+        e = g.insert_edge(parent=layer, source=a, target=b)
+        g.add_edge_geometry(e, [(30, 40)])
+        return g, layer, group, a, b, e
+    return make
+
+def test_merge_remaps_colliding_ids(make_merge_source):
+    g, *_ = make_merge_source()
+    other, layer, group, a, b, e = make_merge_source()
+    id_map = g.merge(other)
+    assert len(g.cells) == 2 * len(other.cells) - 1
+    assert id_map['0'] == '0'
+    assert len(set(id_map.values())) == len(id_map)
+    new_e = g.cells[id_map[e.cell_id]]
+    assert new_e.source is g.cells[id_map[a.cell_id]]
+    assert new_e.target is g.cells[id_map[b.cell_id]]
+    assert new_e.parent is g.cells[id_map['1']]
+    assert g.cells[id_map['1']].parent is g.root
+    # copies do not share style or geometry with the source
+    assert g.cells[id_map[a.cell_id]].style is not a.style
+    assert g.cells[id_map[a.cell_id]].geometry is not a.geometry
+
+def test_merge_keeps_free_ids(make_merge_source):
+    g = MxGraph(diagram_id='mine')
+    other, layer, group, a, b, e = make_merge_source()
+    id_map = g.merge(other)
+    assert id_map == { c: c for c in other.cells }
+    id_map = g.merge(other, remap_all=True)
+    assert all(k != v for k, v in id_map.items() if k != '0')
+
+def test_merge_under_parent_with_offset(make_merge_source):
+    g = MxGraph()
+    target = g.create_group_cell(cell_id='target')
+    other, layer, group, a, b, e = make_merge_source(diagram_id='other')
+    id_map = g.merge(other, parent=target, offset=(1000, 500))
+    assert g.cells[id_map['1']].parent is target
+    assert g.cells[id_map[a.cell_id]].geometry.x == 1010
+    assert g.cells[id_map[a.cell_id]].geometry.y == 520
+    assert g.cells[id_map[group.cell_id]].geometry.x == 1100
+    # inside a positioned group: relative to the group, so not moved
+    assert g.cells[id_map[b.cell_id]].geometry.x == 5
+    new_e = g.cells[id_map[e.cell_id]]
+    assert (new_e.geometry.points[0].x, new_e.geometry.points[0].y) == (1030, 540)
+    assert a.geometry.x == 10
+
+def test_merge_with_ids(make_merge_source):
+    g = MxGraph(diagram_id='mine')
+    keep = g.insert_vertex(cell_id='keep')
+    other, layer, group, a, b, e = make_merge_source()
+    id_map = g.merge(other, ids={ a.cell_id: 'new-a' })
+    assert g.cells['new-a'].style['shape'] == 'cylinder'
+    assert g.cells[id_map[e.cell_id]].source is g.cells['new-a']
+    n = len(g.cells)
+    with pytest.raises(ValueError):
+        g.merge(other, ids={ a.cell_id: 'keep' })
+    with pytest.raises(ValueError):
+        g.merge(other, ids={ a.cell_id: 'x', b.cell_id: 'x' })
+    assert len(g.cells) == n
+    assert g.cells['keep'] is keep
+
+def test_merge_into_itself(make_merge_source):
+    g, layer, group, a, b, e = make_merge_source()
+    n = len(g.cells)
+    id_map = g.merge(g)
+    assert len(g.cells) == 2 * n - 1
+    assert g.cells[id_map[e.cell_id]].target is g.cells[id_map[b.cell_id]]
+
+def test_merge_is_one_change_set(make_merge_source):
+    g = MxGraph()
+    changes = []
+    g.add_listener(changes.append)
+    other, *_ = make_merge_source()
+    id_map = g.merge(other)
+    assert len(changes) == 1
+    assert changes[0].added == set(id_map.values()) - { '0' }
+
+def test_validate_reports_all_problems(cell_store):
+    graph_string = """
+    <mxGraphModel>
+  <root>
+    <mxCell id="0" />
+    <mxCell id="1" parent="0" />
+    <mxCell id="v1" vertex="1" parent="1">
+      <mxGeometry x="90" y="320" width="120" height="60" as="geometry" />
+    </mxCell>
+    <mxCell id="v2" vertex="1" parent="missing" />
+    <mxCell id="e1" edge="1" vertex="1" parent="1" source="v1" target="nowhere">
+      <mxGeometry relative="1" as="geometry" />
+    </mxCell>
+    <mxCell id="c1" parent="c2" />
+    <mxCell id="c2" parent="c3" />
+    <mxCell id="c3" parent="c1" />
+    <mxCell id="c4" parent="c3" />
+    <mxCell id="v1" vertex="1" parent="1">
+      <mxGeometry x="0" y="0" width="120" height="60" as="geometry" />
+    </mxCell>
+  </root>
+</mxGraphModel>"""
+    graph_xml = dxml.fromstring(graph_string)
+    with pytest.raises(ValidationError) as excinfo:
+        MxGraphModel.from_xml(cell_store, graph_xml, validate=True)
+    result = excinfo.value.result
+    assert not result.ok
+    assert [ p.cell_id for p in result.by_kind('duplicate-id') ] == [ 'v1' ]
+    assert [ p.cell_id for p in result.by_kind('dangling-parent') ] == [ 'v2' ]
+    assert [ p.cell_id for p in result.by_kind('dangling-target') ] == [ 'e1' ]
+    assert [ p.cell_id for p in result.by_kind('vertex-and-edge') ] == [ 'e1' ]
+    assert [ p.cell_id for p in result.by_kind('missing-geometry') ] == [ 'v2' ]
+    cycles = result.by_kind('parent-cycle')
+    assert len(cycles) == 1
+    assert set(cycles[0].message.split(': ')[1].split(' -> ')) == { 'c1', 'c2', 'c3' }
+    assert len(result) == 6
+
+def test_validate_without_problems(query_graph):
+    g, layer, db, box, edge = query_graph
+    assert g.validate().ok
+    g.cells['other-key'] = box
+    assert [ p.kind for p in g.validate() ] == [ 'id-mismatch' ]
+
+def test_read_file_with_validation(query_graph):
+    import io
+    g, layer, db, box, edge = query_graph
+    f = io.StringIO()
+    g.to_file(f)
+    f.seek(0)
+    g2 = MxGraph.from_file(f, validate=True)
+    assert len(g2.cells) == len(g.cells)
+
+def test_snapshot_is_isolated_from_changes(query_graph):
+    g, layer, db, box, edge = query_graph
+    snap = g.snapshot()
+    box['value'] = 'renamed'
+    db.style['shape'] = 'cloud'
+    box.geometry.x = 500
+    edge.target = box
+    v = g.insert_vertex(parent=layer)
+    del g.cells[db.cell_id]
+    assert snap[box.cell_id]['value'] == 'server'
+    assert snap[db.cell_id].style['shape'] == 'cylinder'
+    assert snap[box.cell_id].geometry.x is None
+    assert snap[edge.cell_id].target.cell_id == db.cell_id
+    assert snap[edge.cell_id].parent.cell_id == layer.cell_id
+    assert v.cell_id not in snap
+    assert set(snap) == set(g.cells) - { v.cell_id } | { db.cell_id }
+    assert len(snap) == len(g.cells)
+    # a later snapshot sees the new state
+    snap2 = g.snapshot()
+    assert snap2[box.cell_id]['value'] == 'renamed'
+    assert db.cell_id not in snap2
+
+def test_snapshot_is_isolated_from_new_waypoints(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.add_edge_geometry(edge, [(10, 20)])
+    snap = g.snapshot()
+    edge.geometry.points = edge.geometry.points + [ MxPoint(30, 40) ]
+    edge.geometry.points = [ MxPoint(99, 20) ] + edge.geometry.points[1:]
+    assert [ (p.x, p.y) for p in snap[edge.cell_id].geometry.points ] == [ (10, 20) ]
+    assert [ (p.x, p.y) for p in edge.geometry.points ] == [ (99, 20), (30, 40) ]
+
+def test_dropped_snapshot_is_freed_without_gc(query_graph):
+    g, layer, db, box, edge = query_graph
+    snap = g.snapshot()
+    e = snap[edge.cell_id]
+    assert e.source.cell_id == box.cell_id
+    gc.disable()
+    try:
+        del snap
+        for i in range(100):
+            box['value'] = str(i)
+        stats = g.stats()['snapshots']
+        assert (stats['alive'], stats['saved']) == (0, 0)
+    finally:
+        gc.enable()
+    with pytest.raises(ReferenceError):
+        e.source
+
+def test_snapshot_cells_are_read_only(query_graph):
+    g, layer, db, box, edge = query_graph
+    snap = g.snapshot()
+    cell = snap[db.cell_id]
+    with pytest.raises(TypeError):
+        cell['value'] = 'x'
+    with pytest.raises(TypeError):
+        cell.style['shape'] = 'x'
+    with pytest.raises(TypeError):
+        cell.geometry.x = 1
+    assert cell.to_xml().get('style') == db.style.to_string()
+
+def test_snapshot_with_concurrent_writer():
+    import threading
+    g = MxGraph()
+    vs = [ g.insert_vertex(x=0, y=0, width=10, height=10) for i in range(200) ]
+    for v in vs:
+        v['value'] = 'old'
+    snap = g.snapshot()
+    done = threading.Event()
+    def writer():
+        for i in range(20):
+            for v in vs:
+                v['value'] = 'new%d' % i
+                v.geometry.x = i + 1
+        done.set()
+    t = threading.Thread(target=writer)
+    t.start()
+    while not done.is_set():
+        for v in vs:
+            cell = snap[v.cell_id]
+            assert cell['value'] == 'old'
+            assert cell.geometry.x == 0
+    t.join()
+    assert all(snap[v.cell_id]['value'] == 'old' for v in vs)
+
+def test_stats(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.add_edge_geometry(edge, [(10, 10), (20, 10)])
+    g.insert_vertex(parent=layer, style={'rounded': '0'})
+    stats = g.stats()
+    assert stats['cells'] == 6
+    assert stats['vertices'] == 3
+    assert stats['edges'] == 1
+    assert stats['waypoints'] == 2
+    assert stats['styles'] == 4
+    assert stats['distinct_styles'] == 3
+    assert stats['bytes']['attrs'] > 0 and stats['bytes']['geometry'] > 0
+    assert stats['bytes']['total'] == sum(v for k, v in stats['bytes'].items() if k != 'total')
+    assert stats['indexes'] == {}
+    assert stats['snapshots']['alive'] == 0
+
+def test_stats_of_indexes_and_snapshots(query_graph):
+    g, layer, db, box, edge = query_graph
+    g.create_index('style', 'shape')
+    g.query(StyleQuery('shape', 'cylinder'))
+    g.query(KindQuery('vertex'))
+    snap = g.snapshot()
+    snap[db.cell_id]
+    snap[db.cell_id]
+    box['value'] = 'changed'
+    stats = g.stats()
+    assert stats['indexes'] == { 'style:shape': { 'entries': 1, 'values': 1, 'lookups': 1, 'bytes': stats['indexes']['style:shape']['bytes'] } }
+    assert stats['queries'] == { 'total': 2, 'indexed': 1, 'hit_rate': 0.5 }
+    assert stats['snapshots']['alive'] == 1
+    assert stats['snapshots']['saved'] == 1
+    assert stats['snapshots']['hit_rate'] == 0.5
+    del snap
+    assert g.stats()['snapshots']['alive'] == 0
+
+LAYERED_GRAPH = """
+<mxGraphModel pageWidth="850">
+  <root>
+    <mxCell id="0" />
+    <mxCell id="a1" value="A1" vertex="1" parent="g1">
+      <mxGeometry x="10" y="10" width="80" height="80" as="geometry" />
+    </mxCell>
+    <mxCell id="L1" parent="0" />
+    <mxCell id="L2" parent="0" />
+    <mxCell id="g1" value="" style="group" vertex="1" parent="L1">
+      <mxGeometry x="340" y="240" width="80" height="210" as="geometry" />
+    </mxCell>
+    <mxCell id="a2" value="A2" vertex="1" parent="L1">
+      <mxGeometry x="500" y="10" width="80" height="80" as="geometry" />
+    </mxCell>
+    <mxCell id="b1" value="B1" vertex="1" parent="L2">
+      <mxGeometry x="10" y="500" width="80" height="80" as="geometry" />
+    </mxCell>
+    <mxCell id="b2" value="B2" vertex="1" parent="L2">
+      <mxGeometry x="200" y="500" width="80" height="80" as="geometry" />
+    </mxCell>
+    <mxCell id="e1" edge="1" parent="L2" source="b1" target="a1">
+      <mxGeometry relative="1" as="geometry" />
+    </mxCell>
+    <mxCell id="e2" edge="1" parent="L2" source="b1" target="b2">
+      <mxGeometry relative="1" as="geometry" />
+    </mxCell>
+  </root>
+</mxGraphModel>"""
+
+def test_select_cells():
+    records = [ ('0', None, None, None), ('L1', '0', None, None), ('g1', 'L1', None, None),
+            ('a1', 'g1', None, None), ('L2', '0', None, None), ('b1', 'L2', None, None),
+            ('e1', 'L2', 'b1', 'a1') ]
+    assert select_cells(records, { 'L1' }) == { '0', 'L1', 'g1', 'a1', 'e1', 'L2', 'b1' }
+    assert select_cells(records, { 'g1' }) == { '0', 'L1', 'g1', 'a1', 'e1', 'L2', 'b1' }
+    assert select_cells(records, { 'L2' }) == { '0', 'L2', 'b1', 'e1', 'L1', 'g1', 'a1' }
+    assert select_cells(records[:4], { 'L1' }) == { '0', 'L1', 'g1', 'a1' }
+
+def test_read_mxgraph_model_single_layer(cell_store):
+    graph_xml = dxml.fromstring(LAYERED_GRAPH)
+    MxGraphModel.from_xml(cell_store, graph_xml, parents={ 'L1' }, validate=True)
+    # the edge e1 from the other layer brings its parent and source along
+    assert set(cell_store) == { '0', 'L1', 'g1', 'a1', 'a2', 'e1', 'L2', 'b1' }
+    assert cell_store['a1'].parent is cell_store['g1']
+    assert cell_store['e1'].source is cell_store['b1']
+    assert cell_store.validate().ok
+
+def test_read_mxgraph_model_stream_single_layer(cell_store):
+    import io
+    gm = MxGraphModel.from_stream(cell_store, io.StringIO(LAYERED_GRAPH), parents={ 'L2' })
+    assert gm['pageWidth'] == '850'
+    assert set(cell_store) == { '0', 'L2', 'b1', 'b2', 'e1', 'e2', 'L1', 'g1', 'a1' }
+    assert cell_store['e2'].target is cell_store['b2']
+    assert cell_store['b2'].geometry.x == 200
+
+def test_read_mxgraph_model_stream_all(cell_store):
+    import io
+    MxGraphModel.from_stream(cell_store, io.StringIO(LAYERED_GRAPH))
+    assert len(cell_store) == 10
+
+def test_read_file_single_layer():
+    import io
+    g = MxGraph()
+    layer1 = g.create_group_cell(cell_id='L1')
+    layer2 = g.create_group_cell(cell_id='L2')
+    a = g.insert_vertex(parent=layer1, x=1, y=2, width=3, height=4)
+    b = g.insert_vertex(parent=layer2, x=1, y=2, width=3, height=4)
+    c = g.insert_vertex(parent=layer2, x=1, y=2, width=3, height=4)
+    g.insert_edge(parent=layer2, source=b, target=c)
+    f = io.StringIO()
+    g.to_file(f)
+    f.seek(0)
+    g2 = MxGraph.from_file(f, parents={ 'L1' })
+    assert set(g2.cells) == { '0', 'L1', a.cell_id }
+
+def test_write_file_after_partial_load():
+    import io
+    g = MxGraph()
+    g.mxgraph_model = MxGraphModel.from_xml(g.cells, dxml.fromstring(LAYERED_GRAPH), parents={ 'L1' })
+    f = io.StringIO()
+    g.to_file(f)
+    f.seek(0)
+    g2 = MxGraph.from_file(f, validate=True)
+    assert set(g2.cells) == set(g.cells)
+    assert g2.cells['e1'].parent is g2.cells['L2']
+
 
 def xtest_read_file():
     mx = MxGraphModel()
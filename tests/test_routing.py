@@ -0,0 +1,146 @@
+import pytest
+from mxgraph.mxgraph import *
+from mxgraph.spatial import *
+from mxgraph.routing import *
+
+def inside(p, cell):
+    g = cell.geometry
+    return g.x < p[0] < g.x + g.width and g.y < p[1] < g.y + g.height
+
+def segments(edge):
+    s = edge.source.geometry
+    t = edge.target.geometry
+    pts = [ (s.x + s.width / 2, s.y + s.height / 2) ]
+    pts += [ (p.x, p.y) for p in edge.geometry.points ]
+    pts.append((t.x + t.width / 2, t.y + t.height / 2))
+    return list(zip(pts, pts[1:]))
+
+def crosses(seg, cell):
+    (x1, y1), (x2, y2) = seg
+    g = cell.geometry
+    if x1 == x2:
+        return g.x < x1 < g.x + g.width and min(y1, y2) < g.y + g.height and max(y1, y2) > g.y
+    return g.y < y1 < g.y + g.height and min(x1, x2) < g.x + g.width and max(x1, x2) > g.x
+
+def test_spatial_grid():
+    grid = SpatialGrid(bucket_size=50)
+    grid.insert('a', (0, 0, 100, 100))
+    grid.insert('b', (200, 200, 10, 10))
+    assert grid.at_point(50, 50) == ['a']
+    assert grid.at_point(150, 150) == []
+    assert grid.intersecting((90, 90, 120, 120)) == { 'a', 'b' }
+    grid.remove('a')
+    assert grid.intersecting((0, 0, 100, 100)) == set()
+    assert len(grid) == 1
+
+def test_spatial_grid_polyline():
+    grid = SpatialGrid(bucket_size=50)
+    grid.insert_polyline('d', [ (0, 0), (1000, 1000) ])
+    grid.insert_polyline('l', [ (0, 500), (500, 500), (500, 0) ])
+    assert grid.rects['d'] == (0, 0, 1000, 1000)
+    assert len(grid.buckets) < 100
+    assert grid.intersecting((480, 480, 40, 40)) == { 'd', 'l' }
+    assert grid.intersecting((900, 0, 50, 50)) == set()
+    assert grid.intersecting((100, 100, 200, 200)) == { 'd' }
+    assert grid.at_point(500, 250) == [ 'l' ]
+    grid.remove('d')
+    grid.remove('l')
+    assert grid.buckets == {}
+
+def test_route_around_obstacle():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=100, width=40, height=40)
+    b = g.insert_vertex(x=300, y=100, width=40, height=40)
+    wall = g.insert_vertex(x=140, y=0, width=40, height=260)
+    e = g.insert_edge(source=a, target=b)
+    assert route_edges(g) == []
+    assert len(e.geometry.points) >= 2
+    for seg in segments(e):
+        (x1, y1), (x2, y2) = seg
+        assert x1 == x2 or y1 == y2
+        assert not crosses(seg, wall)
+
+def test_router_stats():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=100, width=40, height=40)
+    b = g.insert_vertex(x=300, y=100, width=40, height=40)
+    g.insert_vertex(x=140, y=0, width=40, height=260)
+    router = OrthogonalRouter(g)
+    router.route(g.query(KindQuery('edge')) + [ g.insert_edge(source=a, target=b), g.insert_edge(source=b, target=a) ])
+    stats = router.stats()
+    assert stats['obstacles'] == 3
+    assert stats['crossing_cache'] > 0
+    assert stats['crossing_lookups'] > stats['crossing_cache']
+    assert 0 < stats['crossing_hit_rate'] < 1
+    assert stats['used_segments'] > 0
+
+def test_straight_route_has_no_waypoints():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=0, width=40, height=40)
+    b = g.insert_vertex(x=200, y=0, width=40, height=40)
+    e = g.insert_edge(source=a, target=b)
+    route_edges(g, [e])
+    assert e.geometry.points == []
+
+def test_route_bend_aligns_with_centers():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=0, width=40, height=40)
+    b = g.insert_vertex(x=200, y=200, width=40, height=40)
+    e = g.insert_edge(source=a, target=b)
+    route_edges(g)
+    for (x1, y1), (x2, y2) in segments(e):
+        assert x1 == x2 or y1 == y2
+
+def test_route_inside_container():
+    g = MxGraph()
+    group = g.insert_vertex(x=100, y=100, width=500, height=300)
+    a = g.insert_vertex(parent=group, x=10, y=10, width=40, height=40)
+    b = g.insert_vertex(parent=group, x=300, y=200, width=40, height=40)
+    e = g.insert_edge(parent=group, source=a, target=b)
+    assert route_edges(g) == []
+    assert g.absolute_bounds(a) == (110, 110, 40, 40)
+    # waypoints are relative to the container: one bend in line with the
+    # centers (30, 30) and (320, 220) of a and b
+    assert [ (p.x, p.y) for p in e.geometry.points ] in ([ (30, 220) ], [ (320, 30) ])
+
+def test_route_inside_cell_without_geometry():
+    g = MxGraph()
+    group = g.insert_vertex(x=100, y=100, width=500, height=300)
+    inner = g.create_group_cell(cell_id='inner', parent=group)
+    a = g.insert_vertex(parent=inner, x=10, y=10, width=40, height=40)
+    b = g.insert_vertex(parent=inner, x=300, y=200, width=40, height=40)
+    e = g.insert_edge(parent=inner, source=a, target=b)
+    assert route_edges(g) == []
+    # inner has no geometry, so the waypoints are relative to the group
+    assert [ (p.x, p.y) for p in e.geometry.points ] in ([ (30, 220) ], [ (320, 30) ])
+
+def test_unroutable_edge_is_reported():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=0, width=40, height=40)
+    b = g.insert_vertex(x=400, y=0, width=40, height=40)
+    walls = [ g.insert_vertex(x=x, y=y, width=1000, height=100) for x, y in [ (-500, -200), (-500, 140) ] ]
+    walls += [ g.insert_vertex(x=x, y=-200, width=100, height=440) for x in [ -200, 600 ] ]
+    walls.append(g.insert_vertex(x=200, y=-200, width=40, height=440))
+    e = g.insert_edge(source=a, target=b)
+    router = OrthogonalRouter(g, margin=5)
+    assert router.route([e]) == [e]
+    assert len(e.geometry.points) == 1
+
+def test_router_grid_is_local():
+    g = MxGraph()
+    a = g.insert_vertex(x=0, y=100, width=40, height=40)
+    b = g.insert_vertex(x=300, y=100, width=40, height=40)
+    g.insert_vertex(x=140, y=0, width=40, height=260)
+    e = g.insert_edge(source=a, target=b)
+    router = OrthogonalRouter(g)
+    router.route([e])
+    lines = router.stats()['grid_lines']
+    # obstacles far away from the end points do not add grid lines
+    for i in range(100):
+        g.insert_vertex(x=5000 + 100 * i, y=5000, width=40, height=40)
+    router = OrthogonalRouter(g, crossing_cache_size=10)
+    router.route([e])
+    stats = router.stats()
+    assert stats['obstacles'] == 103
+    assert stats['grid_lines'] == lines
+    assert 0 < stats['crossing_cache'] <= 10
@@ -0,0 +1,102 @@
+import io
+import os
+import pytest
+import defusedxml.ElementTree as dxml
+import mxgraph.sharding
+from mxgraph.mxgraph import *
+from mxgraph.sharding import *
+
+@pytest.fixture
+def graph():
+    g = MxGraph()
+    layer = g.create_group_cell(cell_id='1')
+    a = g.insert_vertex(parent=layer, cell_id='a', x=0, y=0, width=100, height=50)
+    b = g.insert_vertex(parent=layer, cell_id='b', x=3000, y=0, width=100, height=50)
+    group = g.insert_vertex(parent=layer, cell_id='group', x=100, y=2500, width=300, height=300)
+    c = g.insert_vertex(parent=group, cell_id='c', x=10, y=10, width=20, height=20)
+    d = g.insert_vertex(parent=group, cell_id='d', x=100, y=10, width=20, height=20)
+    ab = g.insert_edge(parent=layer, cell_id='ab', source=a, target=b)
+    g.add_edge_geometry(ab, [(1500, 25)])
+    g.insert_edge(parent=group, cell_id='cd', source=c, target=d)
+    g.insert_edge(parent=group, cell_id='cb', source=c, target=b)
+    g.insert_vertex(parent=layer, cell_id='e', x=5000, y=5000, width=10, height=10)
+    return g
+
+def test_tile_plan(graph):
+    plan = tile_plan(graph, 2000)
+    assert list(plan.names.values()) == [ 'tile-0-0', 'tile-1-0', 'tile-0-1', 'tile-2-2' ]
+    assert plan.members[(0, 1)] == [ 'group', 'c', 'd', 'cd', 'cb' ]
+    assert plan.stubs == { (0, 0): [ 'ab' ], (1, 0): [ 'ab', 'cb' ], (0, 1): [ 'cb' ], (2, 2): [] }
+
+def test_stub_to_edge_inside_group():
+    g = MxGraph()
+    layer = g.create_group_cell(cell_id='1')
+    a = g.insert_vertex(parent=layer, cell_id='a', x=0, y=0, width=100, height=50)
+    group = g.insert_vertex(parent=layer, cell_id='group', x=3000, y=0, width=500, height=500)
+    free = MxCell(g.cells, 'free', edge=True)
+    free.geometry = MxGeometry(relative=True)
+    free.geometry.source_point = MxPoint(10, 10)
+    free.parent = group
+    g.cells.add_cell(free)
+    g.insert_edge(parent=layer, cell_id='af', source=a, target=free)
+    af = build_shards(tile_plan(g, 2000))[(0, 0)].cells['af']
+    assert (af['targetShard'], af['targetCell']) == ('tile-1-0', 'free')
+    assert (af.geometry.target_point.x, af.geometry.target_point.y) == (3010, 10)
+
+def test_build_shards_with_stubs(graph):
+    shards = build_shards(tile_plan(graph, 2000))
+    for shard in shards.values():
+        assert shard.validate().ok
+        assert shard.cells['1'].parent is shard.root
+    s = shards[(0, 0)]
+    assert set(s.cells) == { '0', '1', 'a', 'ab' }
+    ab = s.cells['ab']
+    assert ab.source.cell_id == 'a' and ab.target is None
+    assert (ab['targetShard'], ab['targetCell']) == ('tile-1-0', 'b')
+    assert (ab.geometry.target_point.x, ab.geometry.target_point.y) == (3050, 25)
+    assert [ (p.x, p.y) for p in ab.geometry.points ] == [ (1500, 25) ]
+    # a stub of an edge inside a group of another shard is moved to the layer
+    cb = shards[(1, 0)].cells['cb']
+    assert cb.parent.cell_id == '1'
+    assert cb.source is None and cb.target.cell_id == 'b'
+    assert (cb['sourceShard'], cb['sourceCell']) == ('tile-0-1', 'c')
+    assert (cb.geometry.source_point.x, cb.geometry.source_point.y) == (120, 2520)
+    cb = shards[(0, 1)].cells['cb']
+    assert cb.parent.cell_id == 'group'
+    assert (cb.geometry.target_point.x, cb.geometry.target_point.y) == (2950, -2475)
+
+def test_build_shards_with_new_ids(graph):
+    plan = tile_plan(graph, 2000, remap=True)
+    shards = build_shards(plan)
+    s = shards[(1, 0)]
+    assert s.diagram_id == 'DIAGRAMID-tile-1-0'
+    assert set(s.cells) == { '0', '1', 'DIAGRAMID-tile-1-0-0', 'DIAGRAMID-tile-1-0-1', 'DIAGRAMID-tile-1-0-2' }
+    stub = s.cells[plan.cell_id((1, 0), 'cb')]
+    other = shards[(0, 1)]
+    assert other.cells[stub['sourceCell']]._parent_id == plan.cell_id((0, 1), 'group')
+
+def test_component_plan(graph):
+    plan = component_plan(graph)
+    assert list(plan.names.values()) == [ 'component-0', 'component-1' ]
+    assert plan.members[1] == [ 'e' ]
+    assert plan.stubs == { 0: [], 1: [] }
+    assert len(component_plan(graph, max_cells=100)) == 1
+    assert len(component_plan(graph, max_cells=2)) == 2
+
+@pytest.mark.parametrize('processes', [ True, False ])
+def test_write_shards(tmp_path, processes, graph):
+    plan = tile_plan(graph, 2000)
+    paths = write_shards(plan, str(tmp_path), max_workers=2, processes=processes)
+    assert paths[(0, 1)] == os.path.join(str(tmp_path), 'tile-0-1.drawio')
+    shard = MxGraph.from_file(paths[(0, 1)], validate=True)
+    assert set(shard.cells) == { '0', '1', 'group', 'c', 'd', 'cd', 'cb' }
+    assert shard.cells['cb']['targetCell'] == 'b'
+    # the workers get the plan from the pool, not from the parent's module
+    assert mxgraph.sharding._plan is None
+
+def test_write_pages(graph):
+    f = io.StringIO()
+    write_pages(tile_plan(graph, 2000), f)
+    f.seek(0)
+    pages = dxml.parse(f).getroot().findall('diagram')
+    assert [ p.get('name') for p in pages ] == [ 'tile-0-0', 'tile-1-0', 'tile-0-1', 'tile-2-2' ]
@@ -0,0 +1,84 @@
+import io
+import pytest
+import defusedxml.ElementTree as dxml
+from mxgraph.mxgraph import *
+from mxgraph.svg import *
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+@pytest.fixture
+def page():
+    g = MxGraph()
+    layer = g.create_group_cell(cell_id='1')
+    a = g.insert_vertex(parent=layer, x=0, y=0, width=100, height=50, style={'rounded': '1', 'fillColor': '#dae8fc'})
+    a['value'] = '<b>Start</b> &amp; go'
+    b = g.insert_vertex(parent=layer, x=300, y=0, width=100, height=50, style={'ellipse': None})
+    c = g.insert_vertex(parent=layer, x=2000, y=2000, width=80, height=80, style={'shape': 'cylinder'})
+    e = g.insert_edge(parent=layer, source=a, target=b, style={'dashed': '1'})
+    g.add_edge_geometry(e, [(200, 25)])
+    return g, a, b, c, e
+
+def render(exporter_or_graph, viewport=None):
+    f = io.StringIO()
+    if isinstance(exporter_or_graph, SvgExporter):
+        exporter_or_graph.write(f, viewport)
+    else:
+        write_svg(exporter_or_graph, f, viewport)
+    return dxml.fromstring(f.getvalue())
+
+def test_write_svg_whole_page(page):
+    g, a, b, c, e = page
+    svg = render(g)
+    assert svg.get('viewBox') == '-10 -10 2100 2100'
+    rect = svg.find(SVG + 'rect')
+    assert rect.get('fill') == '#dae8fc'
+    assert rect.get('rx') is not None
+    assert svg.find(SVG + 'ellipse').get('cx') == '350'
+    assert len(svg.findall(SVG + 'path')) == 2
+    texts = [ t.text for t in svg.findall(SVG + 'text') ]
+    assert texts == [ 'Start  & go' ]
+    line = svg.find(SVG + 'polyline')
+    assert line.get('points') == '100,25 200,25 300,25'
+    assert line.get('stroke-dasharray') is not None
+
+def test_write_svg_quotes_style_values():
+    g = MxGraph()
+    hostile = '1" onload="alert(1)'
+    a = g.insert_vertex(x=0, y=0, width=100, height=50, style={'strokeWidth': hostile, 'fontSize': hostile})
+    a['value'] = 'text'
+    b = g.insert_vertex(x=300, y=0, width=100, height=50)
+    g.insert_edge(source=a, target=b, style={'strokeWidth': hostile})
+    svg = render(g)
+    for e in svg.iter():
+        assert e.get('onload') is None
+    assert svg.find(SVG + 'rect').get('stroke-width') == hostile
+    assert svg.find(SVG + 'text').get('font-size') == hostile
+    assert svg.find(SVG + 'polyline').get('stroke-width') == hostile
+
+def test_write_svg_viewport_culls_cells(page):
+    g, a, b, c, e = page
+    exporter = SvgExporter(g)
+    assert [ x.cell_id for x in exporter.visible_cells((1900, 1900, 300, 300)) ] == [ c.cell_id ]
+    svg = render(exporter, (-10, -10, 150, 100))
+    assert svg.get('viewBox') == '-10 -10 150 100'
+    assert len(svg.findall(SVG + 'rect')) == 1
+    assert svg.find(SVG + 'ellipse') is None
+    assert svg.find(SVG + 'polyline') is not None
+    exporter.close()
+
+def test_exporter_follows_changes(page):
+    g, a, b, c, e = page
+    exporter = SvgExporter(g)
+    group = g.insert_vertex(x=5000, y=5000, width=200, height=200)
+    inner = g.insert_vertex(parent=group, x=10, y=10, width=20, height=20)
+    edge = g.insert_edge(source=inner, target=a)
+    assert [ x.cell_id for x in exporter.visible_cells((5000, 5000, 100, 100)) ] == [ group.cell_id, inner.cell_id, edge.cell_id ]
+    # moving the group moves its child and the edge connected to the child
+    group.geometry.x = 8000
+    assert [ x.cell_id for x in exporter.visible_cells((8000, 5000, 100, 100)) ] == [ group.cell_id, inner.cell_id, edge.cell_id ]
+    # the long diagonal edge only covers the buckets along its line
+    assert exporter.visible_cells((5000, 5000, 100, 100)) == []
+    assert [ x.cell_id for x in exporter.visible_cells((4000, 2500, 100, 100)) ] == [ edge.cell_id ]
+    del g.cells[c.cell_id]
+    assert c.cell_id not in [ x.cell_id for x in exporter.visible_cells((1900, 1900, 300, 300)) ]
+    exporter.close()